@@ -1,11 +1,14 @@
+import csv
 import sys
 import os
+import time
 import pickle
+import sqlite3
 from classes import AddressBook, Record, Phone, Birthday, Email, Address
 from notes import Notes
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import WordCompleter
-from folder_sorter import sort_folder
+import threading
+from profiling import CommandProfiler
+from storage import open_storage
 
 
 def input_birthday():
@@ -23,15 +26,41 @@ def input_address():
     return Address(address)
 
 
+class BatchError(Exception):
+    pass
+
+
 class Bot:
-    def __init__(self) -> None:
+    def __init__(self, storage_format: str = 'pickle', autosave_interval: float = 60, profiler: CommandProfiler = None) -> None:
+        self.storage_format = storage_format
+        # Seconds between the background saves of the prompt, 0 turns them off
+        self.autosave_interval = autosave_interval
+        self.page_size = 20
+        # Handlers read their arguments through ask, batch mode answers them from a script
+        self.ask = input
+        self.interactive = True
+        # With autosync off the storages make changes durable on flush only, see run_batch
+        self.autosync = True
         self.contacts_file = 'contacts.bin'
         self.notes_file = 'notes.bin'
-        self.book = AddressBook()
-        self.notes = Notes()
-
-        self.load_file(self.contacts_file, self.book, "AddressBook is created")
-        self.load_file(self.notes_file, self.notes, "New NotesBook is created")
+        self._book = AddressBook()
+        self._notes = None
+        # Messages of the background loading, printed between commands and never into the prompt line
+        self._notices = []
+        self._birthdays_shown = False
+        # Held by a running command and by the autosave, so a flush never sees a half-done change
+        self._state_lock = threading.Lock()
+        # Set by the prompt loop: long operations are handed to it and run in the background
+        self.spawn = None
+        self._stop_watching = threading.Event()
+        # close() runs from the exit command and again from run_batch, only the first call does anything
+        self._closed = False
+        # Times every command, see the 'stats' command
+        self.profiler = profiler or CommandProfiler()
+
+        # run() loads the contacts in the background so that the prompt is usable right away,
+        # the first command that needs them waits for the loading to finish
+        self._contacts_loader = threading.Thread(target=self._load_contacts, daemon=True)
 
         self.commands = {
             'hello': self.greeting,
@@ -42,7 +71,10 @@ class Bot:
             'close': self.exit,
             'exit': self.exit,
             'sort folder': self.folder_sort,
+            'preview sort': self.preview_sort,
+            'watch folder': self.folder_watch,
             'search phone': self.search_phone,
+            'search contacts': self.search_contacts,
             'delete': self.delete,
             'help': self.help,
             'birthday': self.birthday,
@@ -56,32 +88,99 @@ class Bot:
             'edit birthday': self.edit_birthday,
             'edit email': self.edit_email,
             'edit address': self.edit_address,
-            'add tag': self.add_tag
+            'add tag': self.add_tag,
+            'show tags': self.show_tags,
+            'import contacts': self.import_contacts,
+            'export contacts': self.export_contacts,
+            'stats': self.stats
         }
 
-        self.completer = self.set_compliter()
+        self.completer = None
+
+    @property
+    def book(self):
+        self.start_loading_contacts()
+        self._contacts_loader.join()
+        return self._book
+
+    def start_loading_contacts(self):
+        if self._contacts_loader.ident is None:
+            self._contacts_loader.start()
+
+    @property
+    def notes(self):
+        # Notes are loaded only when a notes command is used for the first time
+        if self._notes is None:
+            self._notes = Notes()
+            self.load_file(self.notes_file, self._notes, "New NotesBook is created")
+        return self._notes
+
+    def _load_contacts(self):
+        message = self._load(self.contacts_file, self._book, "AddressBook is created")
+        if message:
+            self._notices.append(message)
+        # The birthday index is built here too, so the birthday notice does not scan the contacts later
+        self._book.upcoming_birthdays(30)
 
     def load_file(self, file_name, entity, message):
-        try:
-            with open(file_name, 'rb') as file:
-                entity.data = pickle.load(file)
-        except:
+        message = self._load(file_name, entity, message)
+        if message:
             print(message)
 
+    def _load(self, file_name, entity, created_message) -> str:
+        # Returns what to tell the user when nothing was loaded. The storage is handed to the
+        # entity only after a successful load or when there is no file yet, so nothing is ever
+        # written over a file that could not be read (or when the loading crashed).
+        storage = open_storage(file_name, self.storage_format, getattr(entity, 'lookups', None))
+        storage.autosync = self.autosync
+        existed = storage.exists()
+        try:
+            data = storage.load()
+        except (OSError, EOFError, pickle.UnpicklingError, sqlite3.DatabaseError) as error:
+            if existed:
+                storage.close()
+                return f'{file_name} could not be loaded ({error}), the changes of this session will not be saved'
+            entity.storage = storage
+            return created_message
+
+        entity.storage = storage
+        entity.data = data
+        return None
+
+    def print_notices(self, birthdays=True):
+        while self._notices:
+            print(self._notices.pop(0))
+        if birthdays and not self._birthdays_shown and not self._contacts_loader.is_alive():
+            self._birthdays_shown = True
+            print(self.birthday(30))
+
     def write_to_file(self, file_name, entity):
+        if entity.storage is not None:
+            entity.storage.checkpoint(entity.data)
+            return
+
         with open(file_name, 'wb') as f:
             pickle.dump(entity.data, f)
 
+    def retry(self, message):
+        # The answer is asked again at the prompt. A script cannot answer again, its next lines
+        # are the next commands, so in batch mode the command fails and the batch stops.
+        if not self.interactive:
+            raise BatchError(message.strip())
+        print(message)
+
     @staticmethod
     def input_error(func):
-        def inner(*args):
+        def inner(self, *args):
             try:
-                return func(*args)
-            except KeyError:
-                return 'Contact not found'
-            except ValueError:
-                return f'Please follow the commands list \n{help}'
-            except IndexError:
+                return func(self, *args)
+            except (KeyError, ValueError, IndexError) as error:
+                # The user sees a hint, the error itself is kept for the 'stats' command
+                self.profiler.record_error(error)
+                if isinstance(error, KeyError):
+                    return 'Contact not found'
+                if isinstance(error, ValueError):
+                    return f'Please follow the commands list \n{help}'
                 return 'Please input command and name'
 
         return inner
@@ -90,72 +189,68 @@ class Bot:
         return "How can I help you?"
 
     def get_record(self, name):
-        for record in self.book.data.values():
-            if record.name.value == name:
-                return record
-
-        return None
+        return self.book.data.get(name)
 
     @input_error
     def get_record_by_name_input(self):
-        name = input('\tEnter contact name: ').rstrip().lstrip()
+        name = self.ask('\tEnter contact name: ').rstrip().lstrip()
         record_to_change = self.get_record(name)
         while record_to_change is None:
-            print(f'There is no such contact with name {name}')
-            name = input('\tEnter contact name: ').rstrip().lstrip()
+            self.retry(f'There is no such contact with name {name}')
+            name = self.ask('\tEnter contact name: ').rstrip().lstrip()
             record_to_change = self.get_record(name)
 
         return record_to_change
 
     @input_error
     def name_input(self):
-        return input('\tEnter name: ')
+        return self.ask('\tEnter name: ')
 
     @input_error
     def phone_input(self, text_for_user=None):
         text = '\t' + (text_for_user if text_for_user != None else '') + 'Enter phone: '
-        phone_input = input(text)
+        phone_input = self.ask(text)
 
         while True:
             try:
                 phone = Phone(phone_input)
                 break
             except ValueError:
-                print('\tInvalid phone number format! Phone must contain 10 digits.')
-                phone_input = input('\tEnter phone: ')
+                self.retry('\tInvalid phone number format! Phone must contain 10 digits.')
+                phone_input = self.ask('\tEnter phone: ')
         return phone
 
     @input_error
     def birhtday_input(self):
-        birthday_input = input('\tEnter date of birthday (DD.MM.YYYY) or pass: ')
+        birthday_input = self.ask('\tEnter date of birthday (DD.MM.YYYY) or pass: ')
         birthday = 'Not set'
         while birthday_input not in ('pass', ''):
             try:
                 birthday = Birthday(birthday_input)
                 break
             except ValueError:
-                print('\tIncorrect birthday format, try again with DD.MM.YYYY')
-                birthday_input = input('\tEnter date of birthday (DD.MM.YYYY) or pass: ')
+                self.retry('\tIncorrect birthday format, try again with DD.MM.YYYY')
+                birthday_input = self.ask('\tEnter date of birthday (DD.MM.YYYY) or pass: ')
 
         return birthday
 
     @input_error
     def email_input(self):
-        email_input = input('\tEnter email or pass: ')
+        email_input = self.ask('\tEnter email or pass: ')
         email = 'Not set'
         while email_input not in ('pass', ''):
             try:
                 email = Email(email_input)
                 break
             except ValueError:
-                print('\tIncorrect email format, try again in format name@test.com')
-                email_input = input('\tEnter or pass: ')
+                self.retry('\tIncorrect email format, try again in format name@test.com')
+                email_input = self.ask('\tEnter or pass: ')
 
         return email
 
     @input_error
     def address_input(self):
-        address = input('\tEnter address or pass: ')
+        address = self.ask('\tEnter address or pass: ')
         if address in ('pass', ''):
             address = 'Not set'
 
@@ -173,11 +268,27 @@ class Bot:
         self.book.add_record(record)
         return 'New contact was added!'
 
+    def page_size_input(self):
+        page_size = self.ask(f'\tEnter page size or pass (default: {self.page_size}): ').strip()
+        while page_size not in ('pass', ''):
+            if page_size.isdigit() and int(page_size) > 0:
+                return int(page_size)
+            self.retry('\tPage size must be a positive number')
+            page_size = self.ask(f'\tEnter page size or pass (default: {self.page_size}): ').strip()
+
+        return self.page_size
+
+    def print_pages(self, pages):
+        for number, page in enumerate(pages):
+            if number > 0 and self.interactive and self.ask("\tPress Enter for the next page or 'q' to stop: ").strip().lower() == 'q':
+                break
+            print(page, end='')
+
     def show_all(self):
         if not self.book.data:
             return 'You have no any contacts saved'
 
-        return self.book.get_records()
+        self.print_pages(self.book.render_pages(self.page_size_input()))
 
     def help(self):
         commands_help = {
@@ -211,24 +322,41 @@ class Bot:
                 <phone>
                 <new phone>''',
             'exit': 'Bot completes its work',
-            'find notes by tags': '''Bot searchs the notes by tag:
-                <tag>''',
+            'export contacts': '''Bot writes all contacts to a file, the format follows the extension:
+                <path to .csv or .vcf file>''',
+            'find notes by tags': '''Bot searchs the notes by tags, tag1|tag2 matches either tag, -tag excludes it:
+                <tags>''',
             'good bye': 'Bot completes its work',
             'hello': 'Greetings in return',
             'help': 'Bot shows the help info',
+            'import contacts': '''Bot adds contacts from a file, invalid rows are written to <file>.rejected.csv:
+                <path to .csv (name,phones,birthday,email,address) or .vcf file>''',
             'link tag': '''Bot attaches a tag to the note:
                 <title>
                 <tag>''',
-            'phone': '''Bot displays the phone number for the given name:
+            'phone': '''Bot displays the phone numbers of contacts whose name contains the given text:
                 <name>''',
+            'preview sort': '''Bot shows which files 'sort folder' would move, nothing is changed:
+                <path to folder>''',
             'remove note': '''Bot removes the note by title:
                 <title>''',
-            'show all': 'Bot displays all saved contacts',
-            'show notes': 'Bit displays all saved notes',
-            'search notes': '''Bot searchs the notes by title:
-                <title>''',
-            'search phone': 'Bot displays the contact at your request',
-            'sort folder': '''Bot sort the folder by file\'s type (image, documents, music, video, archive, other):
+            'show all': '''Bot displays all saved contacts page by page:
+                <page size> (optional)''',
+            'show notes': '''Bot displays all saved notes page by page:
+                <page size> (optional)''',
+            'show tags': 'Bot displays all tags with the number of notes',
+            'search contacts': '''Bot finds contacts by name, email or address, small typos are allowed, best matches first:
+                <text>''',
+            'search notes': '''Bot searchs the notes by words (or their beginnings) in title and text, best matches first:
+                <words>''',
+            'search phone': '''Bot displays all contacts with the given phone:
+                <phone>''',
+            'sort folder': '''Bot sorts the folder in the background by file\'s type (image, documents, music, video, archive, other):
+                <path to folder>
+                <number of parallel movers> (optional, more movers help on network drives)
+                <report|merge> (optional, report or remove identical copies of the sorted files)''',
+            'stats': 'Bot shows the median and 95th percentile time, the memory and the errors of every command used in this session',
+            'watch folder': '''Bot keeps sorting new files of the folder as they arrive, in the background until the bot exits:
                 <path to folder>''',
             'write note': '''Bot saves the note:
                 <title>
@@ -282,75 +410,239 @@ class Bot:
     @input_error
     def phone(self):
         name = self.name_input()
-        return '\t' + self.book.find(name).get_phones()
+        records = self.book.search(name, limit=10)
+        if not records:
+            return f"\tThere is no contacts with name '{name}'"
+
+        return '\n'.join(f'\t{record.name.value}: {record.get_phones()}' for record in records)
 
     @input_error
     def write_note(self):
-        title = input('Please, enter the title: ')
-        text = input('Please, enter the text. You can leave this field empty: ')
-        tag = input('Please, enter the tag. You can leave this field empty: ')
+        title = self.ask('Please, enter the title: ')
+        text = self.ask('Please, enter the text. You can leave this field empty: ')
+        tag = self.ask('Please, enter the tag. You can leave this field empty: ')
         return self.notes.add_note(title, text, tag)
 
     @input_error
     def remove_note(self):
-        note_to_remove = input('Please, enter the title of the note: ')
+        note_to_remove = self.ask('Please, enter the title of the note: ')
         return self.notes.delete_note(note_to_remove)
 
     @input_error
     def edit_note(self):
-        note_to_edit = input('Please, enter the title of the note: ')
-        text = input('Please, enter the new text for the note: ')
+        note_to_edit = self.ask('Please, enter the title of the note: ')
+        text = self.ask('Please, enter the new text for the note: ')
 
         return self.notes.edit_note(note_to_edit, text)
 
     def exit(self):
-        if len(self.book.data) > 0:
-            self.write_to_file(self.contacts_file, self.book)
-
-        if len(self.notes.data) > 0:
-            self.write_to_file(self.notes_file, self.notes)
-
+        self.close()
         print('Good Bye')
         sys.exit()
 
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_watching.set()
+        self.profiler.stop()
+        if self._contacts_loader.ident is not None:
+            self._contacts_loader.join()
+        # Every change is in the journal already, closing only makes it durable. The snapshot is
+        # rewritten by the compaction once the journal has grown, not on every exit.
+        for storage in self._storages():
+            storage.close()
+
+    def autosave(self) -> bool:
+        # Skipped while a command is running, the next round saves its changes. Only the journal
+        # is made durable: rewriting the snapshot under the lock would block the commands, the
+        # compaction folds the journal into it in the background.
+        if not self._state_lock.acquire(blocking=False):
+            return False
+        try:
+            self.flush()
+        finally:
+            self._state_lock.release()
+        return True
+
+    def flush(self):
+        # Makes the changes since the last flush durable without rewriting the snapshots
+        for storage in self._storages():
+            storage.flush()
+
+    def _storages(self):
+        # A file that could not be loaded has no storage, see _load
+        for entity in (self._book, self._notes):
+            if entity is not None and entity.storage is not None:
+                yield entity.storage
+
     @input_error
     def search_phone(self):
         phone_to_search = self.phone_input()
-        result = None
-        for record in self.book.data.values():
-            result = record.find_phone(phone_to_search)
-        return result
+        records = self.book.find_by_phone(phone_to_search.value)
+        if not records:
+            return f'There is no contacts with phone {phone_to_search.value}'
+
+        return '\n'.join(str(record) for record in records)
+
+    def search_contacts(self):
+        query = self.ask('Please, enter the name, email or address to search: ').strip()
+        records = self.book.search(query, mode='fuzzy', limit=10)
+        if not records:
+            return f"There is no contacts matching '{query}'"
+
+        return '\n'.join(str(record) for record in records)
 
     @input_error
     def search_notes_by_tags(self):
-        tag_name = input('Please, enter the tag name: ')
-    
-        return self.notes.find_notes_by_tag(tag_name)
+        tag_names = self.ask('Please, enter the tags (tag1 tag2|tag3 -tag4): ')
+        return self.notes.find_notes_by_tags(tag_names) or 'No notes with such tags'
+
+    def stats(self):
+        lines = [self.profiler.report()]
+        for name, entity in (('contacts', self.book), ('notes', self._notes)):
+            if entity is not None:
+                cache = entity.query_cache
+                lines.append(f'Query cache of {name}: {cache.hits} hits, {cache.misses} misses')
+        return '\n'.join(lines)
+
+    def show_tags(self):
+        counts = self.notes.tag_counts()
+        if not counts:
+            return 'You have no tags yet'
+
+        return '\n'.join('{:<30} {:>5}'.format(tag, count) for tag, count in counts)
+
+    def import_contacts(self):
+        file_name = self.ask('Please, enter the path to .csv or .vcf file: ').strip()
+        if not os.path.exists(file_name):
+            return 'file not found'
+
+        count = len(self.book.data)
+        try:
+            result = self.book.import_contacts(file_name)
+        except (OSError, UnicodeDecodeError, csv.Error) as error:
+            # The batches before the error are stored already
+            return f'Contacts were not imported: {error} ({len(self.book.data) - count} were imported before the error)'
+
+        return str(result)
+
+    def export_contacts(self):
+        file_name = self.ask('Please, enter the path to .csv or .vcf file: ').strip()
+        try:
+            count = self.book.export_contacts(file_name)
+        except OSError as error:
+            return f'Contacts were not exported: {error}'
+
+        return f'{count} contacts were exported to {file_name}'
 
     def folder_sort(self):
-        target_folder_path = input('Please, enter the path to folder: ')
+        target_folder_path = self.ask('Please, enter the path to folder: ')
         if not os.path.exists(target_folder_path):
             return 'folder not found'
 
-        return sort_folder(target_folder_path, display_analytics=True)
+        from folder_sorter import sort_folder
+
+        workers = self.workers_input()
+        dedupe = self.dedupe_input()
+        # The live progress line would fight with the prompt, a background sort only prints its result
+        on_event = self.sort_progress() if self.spawn is None else None
+
+        def sort():
+            return str(sort_folder(target_folder_path, display_analytics=True, workers=workers, incremental=True,
+                                   dedupe=dedupe, on_event=on_event))
+
+        if self.spawn is not None:
+            self.spawn(sort)
+            return f'Sorting {target_folder_path} in the background, the result is printed when it is done'
+        return sort()
+
+    @staticmethod
+    def sort_progress():
+        from folder_sorter import FINISHED
+
+        last_update = 0
+
+        def render(event, stats):
+            nonlocal last_update
+            now = time.perf_counter()
+            # The line is redrawn at most 10 times per second
+            if event != FINISHED and now - last_update < 0.1:
+                return
+            last_update = now
+            done = stats.files_moved + stats.files_skipped
+            print(f'\r\tSorting: {done}/{stats.files_planned} files, '
+                  f'{stats.files_per_second:.0f} files/s, {stats.mb_per_second:.1f} MB/s',
+                  end='\n' if event == FINISHED else '', flush=True)
+
+        return render
+
+    def dedupe_input(self):
+        dedupe = self.ask('Please, enter what to do with duplicate files (report, merge) or pass: ').strip().lower()
+        while dedupe not in ('pass', ''):
+            if dedupe in ('report', 'merge'):
+                return dedupe
+            self.retry("\tPlease, enter 'report', 'merge' or pass")
+            dedupe = self.ask('Please, enter what to do with duplicate files (report, merge) or pass: ').strip().lower()
+
+        return None
+
+    def folder_watch(self):
+        if not self.interactive:
+            # Without the prompt it would run until Ctrl+C and the rest of the script would never run
+            raise BatchError('watch folder needs the prompt, use sort folder in a script')
+        target_folder_path = self.ask('Please, enter the path to folder: ')
+        if not os.path.exists(target_folder_path):
+            return 'folder not found'
+
+        from folder_sorter import watch_folder
+
+        def watch():
+            watch_folder(target_folder_path, stop=self._stop_watching, on_batch=lambda results: print(
+                f'Sorted {sum(1 for _, _, failed in results if not failed)} new files'))
+            return f'Stopped watching {target_folder_path}'
+
+        if self.spawn is not None:
+            self.spawn(watch)
+            return 'Watching the folder in the background until the bot exits, new files are sorted as they arrive'
+
+        print('Watching the folder, new files are sorted as they arrive. Press Ctrl+C to stop')
+        try:
+            return watch()
+        except KeyboardInterrupt:
+            return 'Stopped watching the folder'
+
+    def preview_sort(self):
+        target_folder_path = self.ask('Please, enter the path to folder: ')
+        if not os.path.exists(target_folder_path):
+            return 'folder not found'
+
+        from folder_sorter import sort_folder
+
+        return str(sort_folder(target_folder_path, dry_run=True))
+
+    def workers_input(self):
+        workers = self.ask('Please, enter the number of parallel movers or pass (default: 1): ').strip()
+        while workers not in ('pass', ''):
+            if workers.isdigit() and int(workers) > 0:
+                return int(workers)
+            self.retry('\tNumber of movers must be a positive number')
+            workers = self.ask('Please, enter the number of parallel movers or pass (default: 1): ').strip()
+
+        return 1
 
     @input_error
     def birthday(self, days=None):
         birthday_man = str()
         if days is None:
-            days_depth = int(input('Please, enter the depth in days: '))
+            days_depth = int(self.ask('Please, enter the depth in days: '))
         else:
             days_depth = days
 
         days_depth = days_depth if days_depth != None else 7
 
-        for record in self.book.data.values():
-            try:
-                if record.birthday.value:
-                    if record.days_to_birthday(record.birthday) < days_depth:
-                        birthday_man += '{:^15} {:^15}\n'.format(record.name.value, record.birthday.value)
-            except AttributeError:
-                continue
+        for _, record in self.book.upcoming_birthdays(days_depth):
+            birthday_man += '{:^15} {:^15}\n'.format(record.name.value, str(record.birthday))
 
         if len(birthday_man) == 0 and days is not None:
             return str()
@@ -365,20 +657,25 @@ class Bot:
 
     @input_error
     def search_notes(self) -> str:
-        note_to_search = input('Please, enter the title of the note: ').strip().lower()
+        note_to_search = self.ask('Please, enter the words to search: ').strip().lower()
         return self.notes.find_notes(note_to_search).get_notes()
 
     @input_error
     def add_tag(self) -> str:
-        tag = input('Please, enter the title of the tag: ').strip()
-        title = input('Please, enter the title of the note: ').strip()
+        tag = self.ask('Please, enter the title of the tag: ').strip()
+        title = self.ask('Please, enter the title of the note: ').strip()
 
         return self.notes.add_tag_for_note(tag, title)
 
     def show_notes(self) -> str:
-        return self.notes.get_notes()
+        if not self.notes.data:
+            return 'You have no any notes saved'
+
+        self.print_pages(self.notes.render_pages(self.page_size_input()))
 
     def set_compliter(self):
+        from prompt_toolkit.completion import WordCompleter
+
         function_names = list()
         for command in self.commands.keys():
             function_names.append(command)
@@ -390,15 +687,148 @@ class Bot:
         user_command = user_input.lower().rstrip().lstrip()
         return self.commands.get(user_command)
 
-    def run(self):
+    def run(self, on_ready=None):
+        import asyncio
+
+        asyncio.run(self.run_async(on_ready))
+
+    async def run_async(self, on_ready=None):
+        # prompt_toolkit is the slowest import of the bot, it is loaded only for the interactive prompt.
+        # The contacts start loading after it, an import competing with the loading would delay the prompt.
+        import asyncio
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.patch_stdout import patch_stdout
+
+        # With the autosave on, commands only write their changes and the autosave makes them
+        # durable, one fsync per interval instead of one per change
+        self.autosync = not self.autosave_interval
+        for storage in self._storages():
+            storage.autosync = self.autosync
+        self.start_loading_contacts()
+        self.profiler.start()
+        self.completer = self.set_compliter()
+        session = PromptSession(completer=self.completer)
+        answers = PromptSession()
+        loop = asyncio.get_running_loop()
+        tasks = set()
+
+        # input() in a handler would lose the typed lines to the typeahead of the prompt,
+        # so the handlers ask through a prompt of the loop as well
+        self.ask = lambda text='': asyncio.run_coroutine_threadsafe(answers.prompt_async(text.expandtabs(4)), loop).result()
+
+        def start(func):
+            task = loop.create_task(self._run_in_background(loop, func))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # Handlers run in executor threads, the task is created on the loop thread
+        self.spawn = lambda func: loop.call_soon_threadsafe(start, func)
+        autosave = loop.create_task(self._autosave(loop)) if self.autosave_interval else None
         print('Hello!')
-        print(self.birthday(30))
+
+        # Output of commands and background tasks is printed above the prompt line
+        with patch_stdout():
+            while True:
+                self.print_notices()
+                if on_ready is not None:
+                    # Called once, right before the first prompt is shown
+                    on_ready()
+                    on_ready = None
+
+                try:
+                    user_input = await session.prompt_async('>> ')
+                except KeyboardInterrupt:
+                    continue
+                except EOFError:
+                    user_input = 'exit'
+
+                command = user_input.lower().strip()
+                handler = self.get_handler(command)
+                if handler is None:
+                    print('Unknown command! Please, enter command from the list below:\n')
+                    command = 'help'
+                    handler = self.get_handler(command)
+                # The loop keeps running while a command works, so the autosave and background tasks go on
+                try:
+                    result = await loop.run_in_executor(None, self._run_command, command, handler)
+                except SystemExit:
+                    break
+                except (KeyboardInterrupt, EOFError):
+                    result = 'Command cancelled'
+                except Exception as error:
+                    # The handlers report the errors they expect, anything else fails only the command
+                    result = f'Command failed: {error}'
+                print(result or '')
+
+            if autosave is not None:
+                autosave.cancel()
+            if tasks:
+                print(f'Waiting for {len(tasks)} background tasks to finish')
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run_command(self, command, handler):
+        with self._state_lock:
+            ask = self.ask
+            self.ask = self.profiler.timed_ask(ask)
+            try:
+                return self.profiler.run(command, handler)
+            finally:
+                self.ask = ask
+
+    async def _run_in_background(self, loop, func):
+        try:
+            result = await loop.run_in_executor(None, func)
+        except Exception as error:
+            result = f'Background task failed: {error}'
+        print(result or '')
+
+    async def _autosave(self, loop):
+        import asyncio
 
         while True:
-            user_input = prompt('>> ', completer=self.completer)
-            handler = self.get_handler(user_input)
-            if handler is None:
-                print('Unknown command! Please, enter command from the list below:\n')
-                handler = self.get_handler('help')
-            result = handler()
-            print(result or '')
+            await asyncio.sleep(self.autosave_interval)
+            # An fsync may take a while, it is done off the event loop so typing is not blocked
+            await loop.run_in_executor(None, self.autosave)
+
+    def run_batch(self, lines, save_every=None) -> bool:
+        # Commands and their answers come one per line, exactly as they would be typed at the prompt.
+        # Empty lines and lines starting with # are skipped between commands. Returns False when
+        # the script stopped in the middle: it ended too early or an answer was not accepted.
+        lines = iter(lines)
+
+        def ask(text=''):
+            line = next(lines, None)
+            if line is None:
+                raise EOFError('the script ended in the middle of a command')
+            return line.rstrip('\r\n')
+
+        self.ask = ask
+        self.interactive = False
+        self.autosync = False
+        self.profiler.start()
+
+        commands = 0
+        completed = False
+        try:
+            for line in lines:
+                user_input = line.strip()
+                if not user_input or user_input.startswith('#'):
+                    continue
+
+                handler = self.get_handler(user_input)
+                if handler is None:
+                    print(f'Unknown command: {user_input}')
+                    continue
+                result = self._run_command(user_input.lower(), handler)
+                print(result or '')
+                self.print_notices(birthdays=False)
+
+                commands += 1
+                if save_every and commands % save_every == 0:
+                    self.flush()
+            completed = True
+        except (EOFError, BatchError) as error:
+            print(f'Batch stopped at {user_input!r}: {error}')
+        finally:
+            self.close()
+        return completed
@@ -1,14 +1,23 @@
-from collections import UserDict
-from datetime import datetime, date
+import pickle
+from collections import UserDict, defaultdict
+from itertools import islice
+from datetime import date
 from abc import ABC, abstractmethod
-import re
-from typing import List
+from typing import List, Tuple
+from indexes import BirthdayIndex, FuzzyIndex, NameIndex, QueryCache, birthday_in_year
+from validation import EMAIL_PATTERN, PHONE_PATTERN, parse_date
+
+NOT_SET = 'Not set'
+# Version of the packed field values in the pickles, see Field.__reduce__
+FIELD_FORMAT = 1
+RECORD_ROW = '|{:^10}|{:^20}|{:^15}|{:^15}|{:^20}\n'
+
 
 class Field(ABC):
+    __slots__ = ('__value',)
+
     def __init__(self, value):
-        if not self.is_valid(value):
-            raise ValueError
-        self.__value = value
+        self.value = value
 
     @abstractmethod
     def is_valid(self, value):
@@ -16,27 +25,71 @@ class Field(ABC):
 
     @property
     def value(self):
-        return self.__value
+        return self._unpack(self.__value)
     
     @value.setter
     def value(self, value):
+        self.__value = self._pack(value)
+
+    def _pack(self, value):
+        # Subclasses keep a parsed or a more compact form of the value
         if not self.is_valid(value):
             raise ValueError
-        self.__value = value
+        return value
+
+    def _unpack(self, value):
+        return value
+
+    @classmethod
+    def trusted(cls, packed):
+        # Builds a field from a value that is already validated and packed (see validation.py)
+        field = cls.__new__(cls)
+        field.__value = packed
+        return field
+
+    def __reduce__(self):
+        # Pickled with its packed value, so loading does not validate and parse it again
+        return _unpickle_field, (self.__class__, FIELD_FORMAT, self.__value)
+
+    def __setstate__(self, state):
+        # Fields pickled before they had __slots__ carry their value in a __dict__ state
+        self.value = state['_Field__value']
 
     def __str__(self):
         return str(self.value)
 
+def _unpickle_field(field_class, version, packed):
+    # Fields pickled as Class(value) by older versions are validated by the constructor instead
+    if version != FIELD_FORMAT:
+        raise pickle.UnpicklingError(f'{field_class.__name__} was pickled by a newer version (format {version})')
+    return field_class.trusted(packed)
+
+
 class Name(Field):
-    pass
+    __slots__ = ()
+
+    def is_valid(self, value):
+        return bool(value)
 
 
 class Phone(Field):
+    __slots__ = ()
+
     def is_valid(self, value):
-        return value.isdigit() and len(value) == 10
+        return PHONE_PATTERN.fullmatch(value) is not None
+
+    def _pack(self, value):
+        if not self.is_valid(value):
+            raise ValueError
+        return int(value)
+
+    def _unpack(self, value):
+        return f'{value:010d}'
 
 
 class Address(Field):
+    __slots__ = ()
+
     def is_valid(self, value):
         return True
     
@@ -44,12 +97,24 @@ class Address(Field):
         return str(self.value)
 
 class Birthday(Field):
+    __slots__ = ()
+
     def is_valid(self, value):
         try:
-            datetime.strptime(value, '%d.%m.%Y')
+            parse_date(value)
             return True
         except ValueError:
             return False
+
+    def _pack(self, value):
+        return parse_date(value)
+
+    def _unpack(self, value):
+        return f'{value.day:02d}.{value.month:02d}.{value.year:04d}'
+
+    @property
+    def date(self) -> date:
+        return self._Field__value
     
     def __str__(self):
         return str(self.value)
@@ -59,31 +124,66 @@ class Birthday(Field):
 
 
 class Email(Field):
+    __slots__ = ()
+
     def is_valid(self, value):
         if value:
-            return re.fullmatch(r'([a-zA-Z]{1}[a-zA-Z0-9._]{1,}@[a-zA-Z]+\.[a-zA-Z]{2,})', value)
+            return EMAIL_PATTERN.fullmatch(value) is not None
         return False
             
 
+def _as_field(field_class, value):
+    if isinstance(value, field_class):
+        return value
+    return field_class(value)
+
+
 class Record:
+    # __weakref__ lets the lazy storages hand out the same Record while it is in use
+    __slots__ = ('name', 'phones', 'birthday', 'email', 'address', '_listener', '__weakref__')
+
     def __init__(self, name: Name, phone: List[Phone], birthday: Birthday, email: Email, address: Address):
-        self.name = Name(name)
+        self.name = _as_field(Name, name)
         self.phones = []
         if phone:
-            self.phones.append(Phone(phone.value))
-        self.birthday = Birthday(birthday).value if birthday != "Not set" else birthday
-        self.email = Email(email).value if email != "Not set" else email
-        self.address = Address(address).value if address != "Not set" else address
+            self.phones.append(_as_field(Phone, phone))
+        self.birthday = _as_field(Birthday, birthday) if birthday != NOT_SET else birthday
+        self.email = str(_as_field(Email, email)) if email != NOT_SET else email
+        self.address = str(_as_field(Address, address)) if address != NOT_SET else address
+        # The address book that is notified about changes, it is never pickled with the record
+        self._listener = None
     
+    def __getstate__(self):
+        return {'name': self.name, 'phones': self.phones, 'birthday': self.birthday, 'email': self.email, 'address': self.address}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+
+        self.name = state['name']
+        self.phones = state['phones']
+        # Records pickled by older versions keep the birthday as a string and sometimes the address as Address
+        birthday = state['birthday']
+        self.birthday = Birthday(birthday) if isinstance(birthday, str) and birthday != NOT_SET else birthday
+        self.email = state['email']
+        self.address = str(state['address'])
+        self._listener = None
+
+    def _changed(self):
+        if self._listener is not None:
+            self._listener.record_changed(self)
+
     def add_phone(self, phone: Field):
         phone = Phone(phone)
-        if phone not in self.phones:
+        if self.find_phone(phone) is None:
             self.phones.append(phone)
+            self._changed()
 
     def remove_phone(self, phone: Field):
-        for i in self.phones:
-            if i.value == phone:
-                self.phones.remove(i)
+        phones = [i for i in self.phones if i.value != phone]
+        if len(phones) != len(self.phones):
+            self.phones = phones
+            self._changed()
 
     def change_phone(self, phone:Phone=None, new_phone:Phone=None, phone_obj:Phone=None, new_phone_obj:Phone=None):
         if phone != None and new_phone != None:
@@ -93,24 +193,26 @@ class Record:
             phone = phone_obj
             new_phone = new_phone_obj
         
-        try:
-            index = self.phones.index(phone)
-            self.phones[index] = new_phone
-        except ValueError:
-            return 'Contacts has no such phone'
-        
-        return "Phone '{phone.value}' was successfuly changed to '{new_phone.value}'"
+        for index, current_phone in enumerate(self.phones):
+            if current_phone.value == phone.value:
+                self.phones[index] = new_phone
+                self._changed()
+                return f"Phone '{phone.value}' was successfuly changed to '{new_phone.value}'"
+
+        return 'Contacts has no such phone'
     
     def change_birthday(self, birthday):
-        birthday = Birthday(birthday)
-        self.birthday = str(birthday)
+        self.birthday = _as_field(Birthday, birthday) if birthday != NOT_SET else birthday
+        self._changed()
     
     def change_email(self, email):
         email = Email(email)
         self.email = str(email)
+        self._changed()
 
     def change_address(self, address: Address):
-        self.address = Address(address)
+        self.address = str(Address(address))
+        self._changed()
        
                 
     def find_phone(self, phone: Phone):
@@ -119,14 +221,19 @@ class Record:
                 return i.value
         return None
     
-    def days_to_birthday(self, birthday):
-        if self.birthday:
+    def birthday_date(self):
+        if isinstance(self.birthday, Birthday):
+            return self.birthday.date
+        return None
+
+    def days_to_birthday(self, birthday=None):
+        born = self.birthday_date()
+        if born:
             today = date.today()
-            next_birthday = datetime.strptime(str(self.birthday), '%d.%m.%Y')
-            birthday_day = date(year=today.year, month=next_birthday.month, day=next_birthday.day)
+            birthday_day = birthday_in_year(born.month, born.day, today.year)
 
             if today > birthday_day:
-                birthday_day = date(year=today.year + 1, month=next_birthday.month, day=next_birthday.day)
+                birthday_day = birthday_in_year(born.month, born.day, today.year + 1)
 
             days = birthday_day - today
             return days.days
@@ -142,39 +249,241 @@ class Record:
         return f"Contact name: {self.name.value}, phones: {'; '.join(p.value for p in self.phones)}, birthday: {self.birthday}, email: {self.email}, address: {self.address}"
     
 
+def phone_terms(record) -> List[str]:
+    return [phone.value for phone in record.phones]
+
+
+def birthday_terms(record) -> List[str]:
+    born = record.birthday_date()
+    return [born.isoformat()] if born is not None else []
+
+
 class AddressBook(UserDict):
+    storage = None
+    query_cache = None
+    # Kept by the SQLite storage in indexed tables, the phone and birthday indexes are built
+    # from them without unpickling every record
+    lookups = {'phone': phone_terms, 'birthday': birthday_terms}
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        # Indexes are built on the first query, so loading a book stays a plain assignment
+        self._phone_index = None
+        self._record_phones = {}
+        self._name_index = None
+        self._birthday_index = None
+        self._fuzzy_index = None
+        if hasattr(data, 'bind'):
+            # Records of the lazy storages are decoded again whenever the old object is gone,
+            # every decoded one has to report its changes to the book
+            data.bind(self._bind_record)
+        if self.query_cache is None:
+            self.query_cache = QueryCache()
+        self.query_cache.invalidate()
 
     def add_record(self, record):
-        if record.name.value in self.data:
-            return self.data[record.name.value]
-        self.data[record.name.value] = record
+        # Callers pass back an already stored record after editing it, so it is saved in both cases
+        record = self.data.setdefault(record.name.value, record)
+        if self._name_index is not None:
+            self._name_index.add(record.name.value)
+        self.record_changed(record)
+        self._save(record)
         return record
 
+    def add_records(self, records):
+        # Bulk version of add_record for new contacts: one storage batch instead of a write per record
+        records = [record for record in records if record.name.value not in self.data]
+        for record in records:
+            self.data[record.name.value] = record
+            if self._name_index is not None:
+                self._name_index.add(record.name.value)
+            self.record_changed(record)
+        if self.storage is not None:
+            self.storage.put_many((record.name.value, record) for record in records)
+        return records
+
+    def import_contacts(self, file_name, file_format=None, reject_file=None, batch_size=1000):
+        from contacts_io import import_contacts
+        return import_contacts(self, file_name, file_format, reject_file, batch_size)
+
+    def export_contacts(self, file_name, file_format=None):
+        from contacts_io import export_contacts
+        return export_contacts(self, file_name, file_format)
+
+    def record_changed(self, record):
+        # Every change of a record ends up here (Record.change_*, add_record, add_records)
+        self.query_cache.invalidate()
+        record._listener = self
+        if self._phone_index is not None:
+            self._index_phones(record)
+        if self._birthday_index is not None:
+            self._index_birthday(record)
+        if self._fuzzy_index is not None:
+            self._index_fuzzy(record)
+
+    def _bind_record(self, record):
+        record._listener = self
+
+    def find_by_phone(self, phone: str) -> List[Record]:
+        names = self._phones().get(phone, {})
+        return [self.data[name] for name in names]
+
+    def upcoming_birthdays(self, days: int, today: date = None) -> List[Tuple[date, Record]]:
+        today = today or date.today()
+        return self.query_cache.get(('birthdays', days, today), lambda: [
+            (day, self.data[name]) for day, name in self._birthdays().upcoming(days, today)
+        ])
+
+    def _birthdays(self):
+        if self._birthday_index is None:
+            stored = self._stored_terms('birthday')
+            if stored is not None:
+                birthdays = [(name, date.fromisoformat(born)) for born, name in stored]
+            else:
+                birthdays = []
+                for record in self.data.values():
+                    record._listener = self
+                    born = record.birthday_date()
+                    if born is not None:
+                        birthdays.append((record.name.value, born))
+            self._birthday_index = BirthdayIndex()
+            self._birthday_index.build(birthdays)
+        return self._birthday_index
+
+    def _index_birthday(self, record):
+        born = record.birthday_date()
+        if born is None:
+            self._birthday_index.remove(record.name.value)
+        else:
+            self._birthday_index.add(record.name.value, born)
+
+    def _phones(self):
+        if self._phone_index is None:
+            self._phone_index = defaultdict(dict)
+            stored = self._stored_terms('phone')
+            if stored is not None:
+                phones = defaultdict(list)
+                for phone, name in stored:
+                    self._phone_index[phone][name] = None
+                    phones[name].append(phone)
+                self._record_phones = {name: tuple(record_phones) for name, record_phones in phones.items()}
+            else:
+                for record in self.data.values():
+                    record._listener = self
+                    self._index_phones(record)
+        return self._phone_index
+
+    def _stored_terms(self, name):
+        # (term, contact name) pairs from the storage, None when it does not keep them
+        lookup = getattr(self.data, 'lookup', None)
+        return lookup(name) if lookup is not None else None
+
+    def _index_phones(self, record):
+        name = record.name.value
+        self._unindex_phones(name)
+
+        phones = tuple(phone.value for phone in record.phones)
+        for phone in phones:
+            # dict keys keep the names of one phone unique and in insertion order
+            self._phone_index[phone][name] = None
+        self._record_phones[name] = phones
+
+    def _unindex_phones(self, name):
+        for phone in self._record_phones.pop(name, ()):
+            names = self._phone_index[phone]
+            names.pop(name, None)
+            if not names:
+                del self._phone_index[phone]
+
     def find(self, name):
-        for record in self.data.values():
-            if name in record.name.value:
-                return record
+        records = self.search(name, limit=1)
+        if records:
+            return records[0]
         return f"There is no contacts with name '{name}'"
 
+    def search(self, query: str, mode: str = 'substring', limit: int = None) -> List[Record]:
+        return self.query_cache.get(('search', query, mode, limit), lambda: self._search(query, mode, limit))
+
+    def _search(self, query, mode, limit):
+        if mode == 'exact':
+            return [self.data[query]] if query in self.data else []
+        if mode == 'fuzzy':
+            # Matches name, email and address with a few typos, the result is always bounded
+            names = self._fuzzy().search(query, limit or 10)
+            return [self.data[name] for name in names]
+        if mode == 'prefix':
+            names = self._names().prefix(query, limit)
+        elif mode == 'substring':
+            names = self._names().substring(query, limit)
+        else:
+            raise ValueError(f'Unknown search mode {mode}')
+
+        return [self.data[name] for name in names]
+
+    def _names(self):
+        if self._name_index is None:
+            self._name_index = NameIndex()
+            self._name_index.build(self.data)
+        return self._name_index
+
+    def _fuzzy(self):
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyIndex()
+            for record in self.data.values():
+                record._listener = self
+                self._index_fuzzy(record)
+        return self._fuzzy_index
+
+    def _index_fuzzy(self, record):
+        texts = [value for value in (record.email, record.address) if value != NOT_SET]
+        self._fuzzy_index.add(record.name.value, record.name.value, *texts)
+
     def delete(self, record):
         try:
             del self.data[record.name.value]
         except KeyError:
             print('Contact not found')
+        else:
+            self.query_cache.invalidate()
+            if self._phone_index is not None:
+                self._unindex_phones(record.name.value)
+            if self._name_index is not None:
+                self._name_index.remove(record.name.value)
+            if self._birthday_index is not None:
+                self._birthday_index.remove(record.name.value)
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.remove(record.name.value)
+            if self.storage is not None:
+                self.storage.delete(record.name.value)
         
         return 'Contact was successfully deleted!'
 
+    def _save(self, record):
+        if self.storage is not None:
+            self.storage.put(record.name.value, record)
+
     def iterator(self, n=1):
-        records = list(self.data.values())
-        for i in range(0, len(records), n):
-            yield records[i: i+n]
+        records = iter(self.data.values())
+        page = list(islice(records, n))
+        while page:
+            yield page
+            page = list(islice(records, n))
+
+    def render_pages(self, page_size=20):
+        # Every page is formatted only when it is requested, the header goes with the first one
+        header = RECORD_ROW.format("Name", "Phones", "Birthday", "Email", "Address")
+        for page in self.iterator(page_size):
+            yield header + ''.join(RECORD_ROW.format(record.name.value, ', '.join(p.value for p in record.phones),\
+                str(record.birthday), str(record.email), str(record.address)) for record in page)
+            header = ''
 
     def get_records(self):
-        records = '|{:^10}|{:^20}|{:^15}|{:^15}|{:^20}\n'.format("Name", "Phones", "Birthday", "Email", "Address")
-        for record in self.data.values():
-            records += '|{:^10}|{:^20}|{:^15}|{:^15}|{:^20}\n'.format(record.name.value,\
-                ', '.join(p.value for p in record.phones), str(record.birthday), str(record.email), str(record.address))
-        return records
+        return ''.join(self.render_pages()) or RECORD_ROW.format("Name", "Phones", "Birthday", "Email", "Address")
 
     def __str__(self) -> str:
         return '\n'.join(str(r) for r in self.data.values())
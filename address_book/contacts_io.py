@@ -0,0 +1,267 @@
+import csv
+import os
+import time
+import typing
+from itertools import islice
+from classes import NOT_SET, Birthday, Email, Name, Phone, Record
+from validation import validate_birthdays, validate_emails, validate_phones
+
+
+CSV_FIELDS = ['name', 'phones', 'birthday', 'email', 'address']
+FORMATS = ('csv', 'vcard')
+
+
+class ImportResult:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.imported = 0
+        self.rejected = 0
+        self.reject_file = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return (self.imported + self.rejected) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        report = (f'Imported {self.imported} contacts, rejected {self.rejected} rows '
+                  f'in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)')
+        if self.reject_file:
+            report += f'\nRejected rows were written to {self.reject_file}'
+        return report
+
+
+def guess_format(file_name: str) -> str:
+    return 'vcard' if os.path.splitext(file_name)[1].lower() in ('.vcf', '.vcard') else 'csv'
+
+
+def read_csv(file) -> typing.Iterator[dict]:
+    for row in csv.DictReader(file):
+        yield {field: (row.get(field) or '').strip() for field in CSV_FIELDS}
+
+
+def _unescape(value: str) -> str:
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            result.append('\n' if char in 'nN' else char)
+        else:
+            result.append(char)
+    return ''.join(result)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;').replace('\n', '\\n')
+
+
+def _vcard_lines(file) -> typing.Iterator[str]:
+    # Long lines are folded: a line starting with a space or a tab continues the previous one
+    current = None
+    for line in file:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_vcard(file) -> typing.Iterator[dict]:
+    row = None
+    for line in _vcard_lines(file):
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        prop = key.split(';', 1)[0].upper()
+
+        if prop == 'BEGIN':
+            row = {field: '' for field in CSV_FIELDS}
+            phones = []
+        elif row is None:
+            continue
+        elif prop == 'END':
+            row['phones'] = ';'.join(phones)
+            yield row
+            row = None
+        elif prop == 'FN':
+            row['name'] = _unescape(value).strip()
+        elif prop == 'TEL':
+            phones.append(_unescape(value).strip())
+        elif prop == 'EMAIL' and not row['email']:
+            row['email'] = _unescape(value).strip()
+        elif prop == 'BDAY':
+            row['birthday'] = _vcard_to_birthday(value.strip())
+        elif prop == 'ADR' and not row['address']:
+            parts = [_unescape(part).strip() for part in _split_unescaped(value)]
+            row['address'] = ', '.join(part for part in parts if part)
+
+
+def _split_unescaped(value: str) -> typing.List[str]:
+    parts = ['']
+    escaped = False
+    for char in value:
+        if char == ';' and not escaped:
+            parts.append('')
+            continue
+        parts[-1] += char
+        escaped = char == '\\' and not escaped
+    return parts
+
+
+def _vcard_to_birthday(value: str) -> str:
+    # BDAY is YYYY-MM-DD or YYYYMMDD, the address book uses DD.MM.YYYY
+    digits = value.replace('-', '')[:8]
+    if len(digits) == 8 and digits.isdigit():
+        return f'{digits[6:8]}.{digits[4:6]}.{digits[0:4]}'
+    return value
+
+
+def rows_to_records(rows: typing.List[dict]) -> typing.Tuple[typing.List[typing.Tuple[dict, Record]], typing.List[typing.Tuple[dict, str]]]:
+    # Each column of the batch is validated in one pass and the records are
+    # built from the parsed values without validating the fields again
+    phones = [[phone.strip() for phone in row['phones'].split(';') if phone.strip()] for row in rows]
+    phone_mask, phone_values = validate_phones([phone for row_phones in phones for phone in row_phones])
+    birthday_mask, birthdays = validate_birthdays([row['birthday'] for row in rows])
+    email_mask, emails = validate_emails([row['email'] for row in rows])
+
+    records = []
+    rejects = []
+    position = 0
+    for i, row in enumerate(rows):
+        start, position = position, position + len(phones[i])
+        if not row['name']:
+            error = 'name is empty'
+        elif not phones[i]:
+            error = 'contact has no phones'
+        elif not all(phone_mask[start:position]):
+            error = 'phone must contain 10 digits'
+        elif row['birthday'] and not birthday_mask[i]:
+            error = 'birthday must be in DD.MM.YYYY format'
+        elif row['email'] and not email_mask[i]:
+            error = 'email must be in name@test.com format'
+        else:
+            error = None
+        if error:
+            rejects.append((row, error))
+            continue
+
+        row_phones = [Phone.trusted(phone) for phone in dict.fromkeys(phone_values[start:position])]
+        record = Record(
+            Name.trusted(row['name']),
+            row_phones[0],
+            Birthday.trusted(birthdays[i]) if row['birthday'] else NOT_SET,
+            Email.trusted(emails[i]) if row['email'] else NOT_SET,
+            row['address'] or NOT_SET
+        )
+        record.phones.extend(row_phones[1:])
+        records.append((row, record))
+
+    return records, rejects
+
+
+def record_to_row(record: Record) -> dict:
+    return {
+        'name': record.name.value,
+        'phones': ';'.join(phone.value for phone in record.phones),
+        'birthday': '' if record.birthday == NOT_SET else str(record.birthday),
+        'email': '' if record.email == NOT_SET else str(record.email),
+        'address': '' if record.address == NOT_SET else str(record.address),
+    }
+
+
+def write_csv(records: typing.Iterable[Record], file) -> int:
+    writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record_to_row(record))
+        count += 1
+    return count
+
+
+def write_vcard(records: typing.Iterable[Record], file) -> int:
+    count = 0
+    for record in records:
+        row = record_to_row(record)
+        lines = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{_escape(row["name"])}', f'N:{_escape(row["name"])};;;;']
+        lines += [f'TEL;TYPE=CELL:{phone}' for phone in row['phones'].split(';') if phone]
+        if row['birthday']:
+            day, month, year = row['birthday'].split('.')
+            lines.append(f'BDAY:{year}-{month}-{day}')
+        if row['email']:
+            lines.append(f'EMAIL:{_escape(row["email"])}')
+        if row['address']:
+            lines.append(f'ADR:;;{_escape(row["address"])};;;;')
+        lines.append('END:VCARD')
+        file.write('\r\n'.join(lines) + '\r\n')
+        count += 1
+    return count
+
+
+def import_contacts(book, file_name: str, file_format: str = None, reject_file: str = None,
+                    batch_size: int = 1000) -> ImportResult:
+    # Rows are streamed from the file and validated and stored in batches, so only
+    # one batch of new records is held on top of the book. Invalid rows go to the
+    # reject file together with the reason.
+    file_format = file_format or guess_format(file_name)
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown contacts format {file_format}')
+    reader = read_vcard if file_format == 'vcard' else read_csv
+    reject_file = reject_file or os.path.splitext(file_name)[0] + '.rejected.csv'
+
+    result = ImportResult()
+    rejects = None
+    writer = None
+    try:
+        with open(file_name, newline='', encoding='utf-8') as file:
+            rows = reader(file)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                records, rejected = rows_to_records(batch)
+                new_records = {}
+                for row, record in records:
+                    if record.name.value in new_records or record.name.value in book.data:
+                        rejected.append((row, 'contact already exists'))
+                    else:
+                        new_records[record.name.value] = record
+                result.imported += len(book.add_records(new_records.values()))
+
+                if rejected and writer is None:
+                    rejects = open(reject_file, 'w', newline='', encoding='utf-8')
+                    writer = csv.DictWriter(rejects, fieldnames=CSV_FIELDS + ['error'])
+                    writer.writeheader()
+                    result.reject_file = reject_file
+                for row, error in rejected:
+                    writer.writerow(dict(row, error=error))
+                result.rejected += len(rejected)
+    finally:
+        if rejects is not None:
+            rejects.close()
+
+    result.finished = time.perf_counter()
+    return result
+
+
+def export_contacts(book, file_name: str, file_format: str = None) -> int:
+    file_format = file_format or guess_format(file_name)
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown contacts format {file_format}')
+    writer = write_vcard if file_format == 'vcard' else write_csv
+
+    temp_file = file_name + '.tmp'
+    with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+        count = writer(book.data.values(), file)
+    os.replace(temp_file, file_name)
+    return count
@@ -1,8 +1,13 @@
+import errno
+import hashlib
+import json
 import os
 import shutil
+import time
 import typing
-from pathlib import Path
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Event, Lock
 
 
 CATEGORIES = {
@@ -30,42 +35,400 @@ CATEGORIES = {
 }
 UNKNOWN_CATEGORY = 'unknown'
 CATEGORY_FOLDERS = [*CATEGORIES.keys(), UNKNOWN_CATEGORY]
+MANIFEST_FILE = '.sort_manifest.json'
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+SCANNED = 'scanned'
+MOVED = 'moved'
+SKIPPED = 'skipped'
+FINISHED = 'finished'
+# Below this number of files to hash starting worker processes costs more than it saves
+PARALLEL_HASH_THRESHOLD = 64
 SUPPORTED_EXTENSIONS = set(sum([ext for ext in CATEGORIES.values()], []))
 
 
-def _get_category_by_extension(ext: str) -> str:
-    for category_name, ext_list in CATEGORIES.items():
-        if ext in ext_list:
-            return category_name
+EXTENSION_CATEGORIES = {ext: category for category, ext_list in CATEGORIES.items() for ext in ext_list}
 
-    return UNKNOWN_CATEGORY
 
+def _get_category_by_extension(ext: str) -> str:
+    return EXTENSION_CATEGORIES.get(ext, UNKNOWN_CATEGORY)
+
+
+class Move(typing.NamedTuple):
+    source: str
+    destination: str
+    category: str
+    extension: str
+    size: int = 0
+
+
+class SortStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.files_scanned = 0
+        self.files_planned = 0
+        self.files_moved = 0
+        self.files_skipped = 0
+        # Moved files that dedupe merge removed again as copies of other files
+        self.files_merged = 0
+        self.bytes_moved = 0
+        self.categories = Counter()
+        self.duplicates = {}
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files_moved / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes_moved / 1024 / 1024 / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'files_scanned': self.files_scanned,
+            'files_planned': self.files_planned,
+            'files_moved': self.files_moved,
+            'files_skipped': self.files_skipped,
+            'files_merged': self.files_merged,
+            'bytes_moved': self.bytes_moved,
+            'categories': dict(self.categories),
+            'duplicate_groups': sum(len(groups) for groups in self.duplicates.values()),
+            'elapsed': round(self.elapsed, 3),
+            'files_per_second': round(self.files_per_second, 1),
+            'mb_per_second': round(self.mb_per_second, 2),
+        }
+
+    def __str__(self):
+        merged = f'merged {self.files_merged} duplicates, ' if self.files_merged else ''
+        return (f'Moved {self.files_moved} of {self.files_scanned} files ({self.bytes_moved / 1024 / 1024:.1f} MB), '
+                f'{merged}skipped {self.files_skipped} in {self.elapsed:.2f}s: '
+                f'{self.files_per_second:.0f} files/s, {self.mb_per_second:.1f} MB/s')
+
+
+class SortPlan:
+    def __init__(self, target_folder_path: str, moves: typing.List[Move] = None, folders: typing.List[str] = None):
+        self.target_folder_path = target_folder_path
+        self.moves = moves if moves is not None else []
+        # Folders outside of the category folders, deepest first, removed after the moves if they are empty
+        self.folders = folders if folders is not None else []
+        # Folder manifest of an incremental plan, saved after the plan is executed
+        self.manifest = None
+        self.manifest_changed = False
+        # Folders holding files that were too young to be moved, they are not recorded in the manifest
+        self.deferred = set()
+        self.files_scanned = 0
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __str__(self):
+        lines = [f'{os.path.relpath(move.source, self.target_folder_path)} -> '
+                 f'{os.path.relpath(move.destination, self.target_folder_path)}' for move in self.moves]
+        lines.append(f'{len(self.moves)} files will be moved, {len(self.folders)} folders will be removed if empty')
+        return '\n'.join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            'target_folder_path': self.target_folder_path,
+            'moves': [list(move) for move in self.moves],
+            'folders': self.folders,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SortPlan':
+        return cls(data['target_folder_path'], [Move(*move) for move in data['moves']], data['folders'])
+
+    def dump(self, file_name: str):
+        with open(file_name, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, file_name: str) -> 'SortPlan':
+        with open(file_name, encoding='utf-8') as file:
+            return cls.from_dict(json.load(file))
+
+
+def _move_file(file_path: str, destination: str) -> typing.Tuple[str, bool]:
+    # A plan may be executed later than it was made, never overwrite a file that appeared since then
+    if os.path.lexists(destination):
+        return file_path, True
 
-def _move_file(file_path: str, category_folder: str) -> typing.Tuple[str, bool]:
     try:
-        shutil.move(file_path, category_folder)
-    except shutil.Error:
-        return file_path, True
+        os.rename(file_path, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            return file_path, True
+        try:
+            shutil.move(file_path, destination)
+        except (shutil.Error, OSError):
+            return file_path, True
+
+    return destination, False
+
+
+def _list_folder(folder: str) -> typing.Tuple[typing.List[os.DirEntry], typing.List[os.DirEntry]]:
+    files = []
+    subfolders = []
+    with os.scandir(folder) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry)
+            else:
+                files.append(entry)
+    return files, subfolders
 
-    filename = os.path.basename(file_path)
-    new_file_path = os.path.join(category_folder, filename)
 
-    return new_file_path, False
+def _unique_destination(category_folder: str, filename: str, taken: typing.Set[str], listed: bool = True) -> str:
+    # Name collisions get ' (1)', ' (2)', ... in discovery order, so the result does not depend on timing.
+    # taken holds everything in the listed category folders, only folders skipped by the manifest need a stat call.
+    name, ext = os.path.splitext(filename)
+    destination = os.path.join(category_folder, filename)
+    counter = 1
+    while destination in taken or (not listed and os.path.lexists(destination)):
+        destination = os.path.join(category_folder, f'{name} ({counter}){ext}')
+        counter += 1
+    taken.add(destination)
+    return destination
 
 
-def _check_if_path_is_part_of_category_folder(folder: str, path: str):
-    path = Path(path)
+def load_manifest(target_folder_path: str) -> dict:
+    try:
+        with open(os.path.join(target_folder_path, MANIFEST_FILE), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get('folders', {}) if manifest.get('version') == MANIFEST_VERSION else {}
+
+
+def save_manifest(target_folder_path: str, folders: dict):
+    file_name = os.path.join(target_folder_path, MANIFEST_FILE)
+    with open(file_name + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'version': MANIFEST_VERSION, 'folders': folders}, file)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def plan_sort(target_folder_path: str, incremental: bool = False, min_age: float = 0) -> SortPlan:
+    plan = SortPlan(target_folder_path)
+    taken = set()
+    listed = set()
+    now = time.time()
+
+    # With incremental=True a folder inside the category folders whose mtime matches the manifest is not
+    # listed again: its subfolders come from the manifest and its files were sorted by an earlier run.
+    manifest = load_manifest(target_folder_path) if incremental else {}
+    if incremental:
+        plan.manifest = {}
+
+    def list_category_folder(folder):
+        if not incremental:
+            files, subfolders = _list_folder(folder)
+        else:
+            relpath = os.path.relpath(folder, target_folder_path)
+            mtime = os.stat(folder).st_mtime_ns
+            known = manifest.get(relpath)
+            if known and known[0] == mtime:
+                plan.manifest[relpath] = known
+                return [], [os.path.join(folder, name) for name in known[1]]
+            files, subfolders = _list_folder(folder)
+            plan.manifest[relpath] = [mtime, [entry.name for entry in subfolders]]
+
+        listed.add(folder)
+        taken.update(os.path.join(folder, entry.name) for entry in files + subfolders)
+        return files, [entry.path for entry in subfolders]
+
+    root_files, root_folders = _list_folder(target_folder_path)
+    root_files = [entry for entry in root_files if entry.name not in (MANIFEST_FILE, MANIFEST_FILE + '.tmp')]
+
+    # The category folders are listed first, so that the names in them are known before any destination is picked
+    stack = []
+    for entry in reversed(root_folders):
+        if entry.name in CATEGORY_FOLDERS:
+            stack.append((entry.path, True, list_category_folder(entry.path)))
+        else:
+            stack.append((entry.path, False, None))
+
+    pending = [(target_folder_path, root_files)]
+    while pending or stack:
+        if not pending:
+            folder, in_category, listing = stack.pop()
+            if listing is None and in_category:
+                listing = list_category_folder(folder)
+            elif listing is None:
+                files, subfolders = _list_folder(folder)
+                listing = files, [entry.path for entry in subfolders]
+                plan.folders.append(folder)
+            files, subfolders = listing
+            stack.extend((path, in_category, None) for path in reversed(subfolders))
+            pending.append((folder, files))
+
+        folder, files = pending.pop()
+        plan.files_scanned += len(files)
+        for entry in files:
+            _, ext = os.path.splitext(entry.name)
+            category = _get_category_by_extension(ext)
+            category_folder = os.path.join(target_folder_path, category)
 
-    for category in CATEGORY_FOLDERS:
-        category_path = Path(os.path.join(folder, category))
+            if folder == category_folder:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            # A file that was modified a moment ago may still be being written
+            if min_age and now - stat.st_mtime < min_age:
+                plan.deferred.add(folder)
+                continue
 
-        if category_path == path or category_path in path.parents:
-            return True
+            destination = _unique_destination(category_folder, entry.name, taken, category_folder in listed)
+            plan.moves.append(Move(entry.path, destination, category, ext, stat.st_size))
+
+    plan.folders.reverse()
+    if incremental:
+        # Otherwise a folder whose files were all deferred would never be listed again
+        for folder in plan.deferred:
+            plan.manifest.pop(os.path.relpath(folder, target_folder_path), None)
+    plan.manifest_changed = incremental and plan.manifest != manifest
+    return plan
+
+
+def _move(move: Move, on_result: typing.Callable = None) -> typing.Tuple[Move, str, bool]:
+    result = (move, *_move_file(move.source, move.destination))
+    if on_result is not None:
+        on_result(*result)
+    return result
+
+
+def execute_plan(plan: SortPlan, workers: int = 1, on_result: typing.Callable = None,
+                 update_manifest: bool = True) -> typing.List[typing.Tuple[Move, str, bool]]:
+    # on_result(move, new_file_path, failed) is called as soon as a move is done, from the worker thread.
+    # With update_manifest=False the caller changes the folders further and saves the manifest itself.
+    for category in {move.category for move in plan.moves}:
+        os.makedirs(os.path.join(plan.target_folder_path, category), exist_ok=True)
+
+    if workers <= 1:
+        results = [_move(move, on_result) for move in plan.moves]
+    else:
+        # At most workers * 4 moves wait in the queue of the pool
+        futures = []
+        in_flight = BoundedSemaphore(workers * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for move in plan.moves:
+                in_flight.acquire()
+                future = executor.submit(_move, move, on_result)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+        results = [future.result() for future in futures]
+
+    # Bottom-up, a folder is removed only when nothing was left in it
+    for folder in plan.folders:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+    if plan.manifest is not None and update_manifest:
+        _update_manifest(plan, results)
+
+    return results
+
+
+def _update_manifest(plan: SortPlan, results):
+    # The moves changed the mtime of the folders they touched, they are recorded again so the next run skips them
+    touched = set()
+    for move, _, failed in results:
+        if not failed:
+            touched.add(os.path.dirname(move.source))
+            touched.add(os.path.dirname(move.destination))
+
+    if not touched and not plan.manifest_changed:
+        return
+
+    for folder in touched - plan.deferred:
+        relpath = os.path.relpath(folder, plan.target_folder_path)
+        if relpath in plan.manifest or relpath in CATEGORY_FOLDERS:
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            subfolders = plan.manifest.get(relpath, [0, []])[1]
+            plan.manifest[relpath] = [mtime, subfolders]
 
-    return False
+    save_manifest(plan.target_folder_path, plan.manifest)
 
 
-def _display_analytics(known, unknown, files, folders):
+def _hash_file(file_path: str) -> typing.Tuple[str, typing.Optional[str]]:
+    digest = hashlib.blake2b()
+    try:
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return file_path, None
+    return file_path, digest.hexdigest()
+
+
+def find_duplicates(paths: typing.Iterable[str], workers: int = None,
+                    only: typing.Set[str] = None) -> typing.List[typing.List[str]]:
+    # Only files that share their size with another file are hashed. With only given, a size group
+    # is hashed just when it contains one of those files (e.g. the files moved by this run) and
+    # only the groups of equal files that contain one of them are returned.
+    by_size = defaultdict(list)
+    for path in paths:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            continue
+        if size:
+            by_size[size].append(path)
+
+    candidates = [path for group in by_size.values() if len(group) > 1 and (only is None or not only.isdisjoint(group))
+                  for path in group]
+    if len(candidates) < PARALLEL_HASH_THRESHOLD or workers == 1:
+        hashes = map(_hash_file, candidates)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(_hash_file, candidates, chunksize=16))
+
+    by_hash = defaultdict(list)
+    for path, digest in hashes:
+        if digest is not None:
+            by_hash[digest].append(path)
+    return [sorted(group) for group in by_hash.values()
+            if len(group) > 1 and (only is None or not only.isdisjoint(group))]
+
+
+def deduplicate(target_folder_path: str, new_files: typing.Iterable[str], mode: str = 'report',
+                workers: int = None) -> typing.Dict[str, typing.List[typing.List[str]]]:
+    # Looks for copies of the new files in their category folders. In 'merge' mode only the first copy
+    # is kept, a file that was there before the new ones wins over them. Only new files are ever removed.
+    if mode not in ('report', 'merge'):
+        raise ValueError(f'Unknown dedupe mode {mode}')
+
+    new_files = set(new_files)
+    categories = {os.path.basename(os.path.dirname(path)) for path in new_files}
+
+    duplicates = {}
+    for category in sorted(categories):
+        category_folder = os.path.join(target_folder_path, category)
+        with os.scandir(category_folder) as entries:
+            paths = [entry.path for entry in entries if entry.is_file(follow_symlinks=False)]
+
+        groups = find_duplicates(paths, workers, only=new_files)
+        for group in groups:
+            group.sort(key=lambda path: path in new_files)
+            if mode == 'merge':
+                for path in group[1:]:
+                    if path in new_files:
+                        os.remove(path)
+        if groups:
+            duplicates[category] = groups
+
+    return duplicates
+
+
+def _display_analytics(known, unknown, files, folders, duplicates=None):
     print()
 
     for category, filenames in files.items():
@@ -86,48 +449,97 @@ def _display_analytics(known, unknown, files, folders):
     if unknown:
         print('Unknown file extensions: ', ', '.join(unknown))
 
-    print('All Done')
-
+    for category, groups in (duplicates or {}).items():
+        for group in groups:
+            print(f'Duplicates in {category:15}', ', '.join(map(os.path.basename, group)))
 
-def sort_folder(target_folder_path: str, display_analytics: bool = False) -> None:
-    known = set()
-    unknown = set()
-    folders = defaultdict(list)
-    files = defaultdict(list)
-
-    for dirpath, dirnames, filenames in os.walk(target_folder_path):
-        if not dirnames and not filenames:
-            os.rmdir(dirpath)
-
-        for filename in filenames:
-            _, ext = os.path.splitext(filename)
-            filename = os.path.join(dirpath, filename)
-
-            category = _get_category_by_extension(ext)
-            category_folder = os.path.join(target_folder_path, category)
+    print('All Done')
 
-            os.makedirs(category_folder, exist_ok=True)
 
-            new_file_path, is_same_file = _move_file(filename, category_folder)
+def sort_folder(target_folder_path: str, display_analytics: bool = False, workers: int = 1,
+                dry_run: bool = False, incremental: bool = False, dedupe: str = None,
+                on_event: typing.Callable[[str, SortStats], None] = None) -> typing.Union[SortStats, SortPlan]:
+    # on_event(event, stats) gets SCANNED once the plan is ready, MOVED or SKIPPED for every file
+    # (possibly from a worker thread) and FINISHED at the end
+    stats = SortStats()
+    notify = on_event or (lambda event, stats: None)
 
-            if is_same_file:
-                continue
+    plan = plan_sort(target_folder_path, incremental)
+    if dry_run:
+        if display_analytics:
+            print(plan)
+        return plan
 
-            store = folders if os.path.isdir(new_file_path) else files
-            store[category].append(new_file_path)
+    stats.files_scanned = plan.files_scanned
+    stats.files_planned = len(plan.moves)
+    notify(SCANNED, stats)
 
-            if not ext:
-                ext = 'W/o extension'
+    lock = Lock()
 
-            if ext not in SUPPORTED_EXTENSIONS:
-                unknown.add(ext)
+    def count(move, new_file_path, failed):
+        with lock:
+            if failed:
+                stats.files_skipped += 1
             else:
-                known.add(ext)
+                stats.files_moved += 1
+                stats.bytes_moved += move.size
+                stats.categories[move.category] += 1
+            notify(SKIPPED if failed else MOVED, stats)
 
-    for dirpath, dirnames, filenames in os.walk(target_folder_path):
-        if dirpath != target_folder_path and not _check_if_path_is_part_of_category_folder(target_folder_path, dirpath):
-            shutil.rmtree(dirpath)
+    known = set()
+    unknown = set()
+    folders = defaultdict(list)
+    files = defaultdict(list)
+    moves = {}
+
+    # Merged duplicates change the category folders again, the manifest is saved after them
+    results = execute_plan(plan, workers, count, update_manifest=not dedupe)
+    for move, new_file_path, is_same_file in results:
+        if is_same_file:
+            continue
+
+        files[move.category].append(new_file_path)
+        moves[new_file_path] = move
+
+        ext = move.extension
+        if not ext:
+            ext = 'W/o extension'
+
+        if ext not in SUPPORTED_EXTENSIONS:
+            unknown.add(ext)
+        else:
+            known.add(ext)
+
+    if dedupe:
+        stats.duplicates = deduplicate(target_folder_path, list(moves), dedupe)
+        if dedupe == 'merge':
+            # Merge removed all but the first file of every group, and only new ones
+            merged = [moves[path] for groups in stats.duplicates.values() for group in groups
+                      for path in group[1:] if path in moves]
+            stats.files_moved -= len(merged)
+            stats.files_merged = len(merged)
+            stats.bytes_moved -= sum(move.size for move in merged)
+            stats.categories -= Counter(move.category for move in merged)
+        if plan.manifest is not None:
+            _update_manifest(plan, results)
+
+    stats.finished = time.perf_counter()
+    notify(FINISHED, stats)
             
     if display_analytics:
-        _display_analytics(known, unknown, files, folders)
-    
\ No newline at end of file
+        _display_analytics(known, unknown, files, folders, stats.duplicates)
+
+    return stats
+
+
+def watch_folder(target_folder_path: str, interval: float = 2.0, workers: int = 1, settle: float = 2.0,
+                 on_batch: typing.Callable = None, stop: Event = None):
+    # Polls with incremental plans, the standard library has no inotify binding. Files younger
+    # than settle seconds wait for the next round, so half-written files are not moved.
+    stop = stop or Event()
+    while not stop.is_set():
+        plan = plan_sort(target_folder_path, incremental=True, min_age=settle)
+        results = execute_plan(plan, workers)
+        if results and on_batch is not None:
+            on_batch(results)
+        stop.wait(interval)
@@ -0,0 +1,448 @@
+import calendar
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from itertools import islice
+from typing import List, Tuple
+
+
+class NameIndex:
+    # Every name is indexed by all of its substrings of length 1..gram_size.
+    # Longer queries intersect the posting sets of their grams and the few
+    # remaining candidates are checked with a real substring test.
+    def __init__(self, gram_size: int = 3):
+        self.gram_size = gram_size
+        self._grams = defaultdict(set)
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        index = bisect_left(self._names, name)
+        return index < len(self._names) and self._names[index] == name
+
+    def build(self, names):
+        # Fills an empty index with a single sort, inserting the names one by one
+        # with add() would be quadratic
+        self._names = sorted(set(names))
+        for name in self._names:
+            for gram in self._split(name):
+                self._grams[gram].add(name)
+
+    def add(self, name: str):
+        if name in self:
+            return
+        insort(self._names, name)
+        for gram in self._split(name):
+            self._grams[gram].add(name)
+
+    def remove(self, name: str):
+        if name not in self:
+            return
+        del self._names[bisect_left(self._names, name)]
+        for gram in self._split(name):
+            names = self._grams[gram]
+            names.discard(name)
+            if not names:
+                del self._grams[gram]
+
+    def exact(self, query: str) -> List[str]:
+        return [query] if query in self else []
+
+    def prefix(self, query: str, limit: int = None) -> List[str]:
+        result = []
+        index = bisect_left(self._names, query)
+        while index < len(self._names) and self._names[index].startswith(query):
+            if limit is not None and len(result) >= limit:
+                break
+            result.append(self._names[index])
+            index += 1
+        return result
+
+    def substring(self, query: str, limit: int = None) -> List[str]:
+        if not query:
+            return self._names[:limit]
+
+        if len(query) <= self.gram_size:
+            candidates = self._grams.get(query, set())
+        else:
+            postings = sorted((self._grams.get(gram, set()) for gram in self._query_grams(query)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            candidates = [name for name in candidates if query in name]
+
+        if limit is not None:
+            return heapq.nsmallest(limit, candidates)
+        return sorted(candidates)
+
+    def _split(self, text: str):
+        return {text[i:i + size] for size in range(1, self.gram_size + 1) for i in range(len(text) - size + 1)}
+
+    def _query_grams(self, query: str):
+        size = self.gram_size
+        return {query[i:i + size] for i in range(len(query) - size + 1)}
+
+
+
+
+def birthday_in_year(month: int, day: int, year: int) -> date:
+    # People born on Feb 29 celebrate on Feb 28 in non-leap years
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        day = 28
+    return date(year, month, day)
+
+
+class BirthdayIndex:
+    # Names sorted by (month, day) of birth, so the next N days are one or two
+    # slices of the list (two when the window wraps over the new year).
+    def __init__(self):
+        self._entries = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, birthdays):
+        # Fills an empty index from (name, birthday) pairs with a single sort,
+        # inserting them one by one with add() would be quadratic
+        self._keys = {name: (birthday.month, birthday.day) for name, birthday in birthdays}
+        self._entries = sorted((key, name) for name, key in self._keys.items())
+
+    def add(self, name: str, birthday: date):
+        self.remove(name)
+        key = (birthday.month, birthday.day)
+        insort(self._entries, (key, name))
+        self._keys[name] = key
+
+    def remove(self, name: str):
+        key = self._keys.pop(name, None)
+        if key is not None:
+            del self._entries[bisect_left(self._entries, (key, name))]
+
+    def upcoming(self, days: int, today: date) -> List[Tuple[date, str]]:
+        if days <= 0:
+            return []
+        # Every birthday falls into a window of 366 days, a longer one would only repeat them
+        days = min(days, 366)
+
+        end = today + timedelta(days=days - 1)
+        if today.year != end.year:
+            segments = [(today.year, (today.month, today.day), (12, 31)), (end.year, (1, 1), (end.month, end.day))]
+        else:
+            segments = [(today.year, (today.month, today.day), (end.month, end.day))]
+
+        result = []
+        for year, low, high in segments:
+            if high == (2, 28) and not calendar.isleap(year):
+                high = (2, 29)
+            first = bisect_left(self._entries, (low, ''))
+            last = bisect_left(self._entries, ((high[0], high[1] + 1), ''))
+            for (month, day), name in self._entries[first:last]:
+                result.append((birthday_in_year(month, day, year), name))
+
+        if days == 366:
+            seen = set()
+            result = [(day, name) for day, name in result if not (name in seen or seen.add(name))]
+        return result
+
+
+TOKEN = re.compile(r'\w+')
+TITLE_WEIGHT = 3
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(str(text or '').lower())
+
+
+class TextIndex:
+    # Inverted index token -> {key: weight}. Every query word matches as a prefix
+    # of indexed tokens, all words must match (AND), and the hits are ranked by
+    # the sum of weight * idf of the matched tokens.
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._tokens = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, title: str, text: str):
+        self.remove(key)
+
+        weights = defaultdict(int)
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(text):
+            weights[token] += 1
+
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                insort(self._tokens, token)
+            postings[key] = weight
+        self._keys[key] = tuple(weights)
+
+    def remove(self, key):
+        for token in self._keys.pop(key, ()):
+            postings = self._postings[token]
+            del postings[key]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def search(self, query: str, limit: int = None) -> list:
+        words = tokenize(query)
+        if not words:
+            return list(self._keys)[:limit]
+
+        scores = None
+        for word in sorted(set(words), key=len, reverse=True):
+            word_scores = self._match_prefix(word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {key: score + word_scores[key] for key, score in scores.items() if key in word_scores}
+            if not scores:
+                return []
+
+        ranking = sorted(scores.items(), key=lambda item: -item[1])
+        return [key for key, _ in ranking[:limit]]
+
+    def _match_prefix(self, word: str) -> dict:
+        scores = defaultdict(float)
+        index = bisect_left(self._tokens, word)
+        while index < len(self._tokens) and self._tokens[index].startswith(word):
+            postings = self._postings[self._tokens[index]]
+            idf = math.log(1 + len(self._keys) / len(postings))
+            for key, weight in postings.items():
+                scores[key] = max(scores[key], weight * idf)
+            index += 1
+        return scores
+
+
+class TagIndex:
+    # tag -> {key: None}, the dict keeps the keys of a tag in insertion order
+    def __init__(self):
+        self._keys_by_tag = defaultdict(dict)
+        self._tags = {}
+
+    def add(self, key, tags):
+        self.remove(key)
+        tags = tuple(dict.fromkeys(tags))
+        for tag in tags:
+            self._keys_by_tag[tag][key] = None
+        self._tags[key] = tags
+
+    def remove(self, key):
+        for tag in self._tags.pop(key, ()):
+            keys = self._keys_by_tag[tag]
+            del keys[key]
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def keys(self, tag) -> dict:
+        return self._keys_by_tag.get(tag, {})
+
+    def query(self, *groups, exclude=()) -> list:
+        # Tags inside a group are alternatives (OR), the groups must all match (AND)
+        if groups:
+            matches = [set().union(*(self.keys(tag) for tag in group)) for group in groups]
+            matches.sort(key=len)
+            result = matches[0].intersection(*matches[1:])
+        else:
+            result = set(self._tags)
+
+        for tag in exclude:
+            result.difference_update(self.keys(tag))
+        return sorted(result)
+
+    def counts(self) -> List[Tuple[str, int]]:
+        return sorted(((tag, len(keys)) for tag, keys in self._keys_by_tag.items()), key=lambda item: (-item[1], item[0]))
+
+
+def word_distance(query: str, word: str, max_distance: float = math.inf) -> float:
+    # Levenshtein distance where swapping two neighbouring letters is one edit as well,
+    # gives up with inf as soon as the distance is surely over max_distance
+    before, previous = None, list(range(len(word) + 1))
+    for i, query_char in enumerate(query, 1):
+        current = [i]
+        for j, word_char in enumerate(word, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (query_char != word_char))
+            if j > 1 and i > 1 and query_char == word[j - 2] and query[i - 2] == word_char:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > max_distance:
+            return math.inf
+        before, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    # Every key is indexed by the words of its texts (an email stays one word), and
+    # every distinct word by its trigrams. A query word collects the words that share
+    # its rarest trigrams and keeps those that start with it (distance 0.5, 0 when equal)
+    # or are within a few typos of it by the edit distance. The keys matching all query
+    # words are ranked by the sum of the distances.
+    def __init__(self, max_candidates: int = 2000):
+        self.max_candidates = max_candidates
+        self._words = []
+        self._word_ids = {}
+        # trigram -> ids of the words containing it
+        self._postings = defaultdict(lambda: array('I'))
+        # word -> key, or a set of keys when the word is shared (most words are not)
+        self._keys_by_word = {}
+        self._words_by_key = {}
+
+    def __len__(self):
+        return len(self._words_by_key)
+
+    def add(self, key, *texts):
+        self.remove(key)
+        words = tuple({word: None for text in texts if text for word in split_words(text)})
+        for word in words:
+            self._link(word, key)
+        self._words_by_key[key] = words
+
+    def remove(self, key):
+        for word in self._words_by_key.pop(key, ()):
+            keys = self._keys_by_word[word]
+            if isinstance(keys, set):
+                keys.discard(key)
+                if len(keys) == 1:
+                    self._keys_by_word[word] = keys.pop()
+            else:
+                # The word stays in the trigram postings, it just matches no keys until it is used again
+                del self._keys_by_word[word]
+
+    def search(self, query: str, limit: int = 10) -> list:
+        matches = [self._similar_words(word) for word in dict.fromkeys(split_words(query))]
+        if not matches or not all(matches):
+            return []
+
+        found = sorted((self._keys_within(similar, max(similar.values())) for similar in matches), key=len)
+        keys = found[0].intersection(*found[1:])
+        if len(keys) > self.max_candidates:
+            # Too many to rank one by one, the keys that match every word at its best distance are enough
+            best = set.intersection(*(self._keys_within(similar, min(similar.values())) for similar in matches))
+            if len(best) >= limit:
+                return heapq.nsmallest(limit, best)
+
+        ranked = ((sum(self._distance(key, similar) for similar in matches), key) for key in keys)
+        return [key for _, key in heapq.nsmallest(limit, ranked)]
+
+    def _distance(self, key, similar: dict) -> float:
+        return min(similar[word] for word in self._words_by_key[key] if word in similar)
+
+    def _similar_words(self, word: str) -> dict:
+        grams = trigrams(' ' + word)
+        if not grams:
+            return {word: 0} if word in self._keys_by_word else {}
+        max_typos = 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+
+        # One typo changes at most four trigrams, so a close enough word shares at least
+        # `needed` of them and has to contain one of the rarest len(grams) - needed + 1
+        needed = max(1, len(grams) - 4 * max_typos)
+        rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))[:len(grams) - needed + 1]
+        candidates = {self._word_ids[word]} if word in self._word_ids else set()
+        for gram in rarest:
+            room = self.max_candidates - len(candidates)
+            if room <= 0:
+                break
+            candidates.update(islice(self._postings.get(gram, ()), room))
+
+        padded = trigrams(f' {word} ')
+        similar = {}
+        for word_id in candidates:
+            candidate = self._words[word_id]
+            if candidate not in self._keys_by_word:
+                continue
+            if candidate.startswith(word):
+                similar[candidate] = 0 if candidate == word else 0.5
+            elif abs(len(candidate) - len(word)) > max_typos:
+                continue
+            elif len(padded & trigrams(f' {candidate} ')) >= max(len(word), len(candidate)) - 4 * max_typos:
+                distance = word_distance(word, candidate, max_typos)
+                if distance <= max_typos:
+                    similar[candidate] = distance
+        return similar
+
+    def _keys_within(self, similar: dict, max_distance: float) -> set:
+        # The result is only read, a single shared word returns its own set without a copy
+        found = [self._keys_by_word[word] for word, distance in similar.items() if distance <= max_distance]
+        if len(found) == 1 and isinstance(found[0], set):
+            return found[0]
+
+        keys = set()
+        for word_keys in found:
+            if isinstance(word_keys, set):
+                keys.update(word_keys)
+            else:
+                keys.add(word_keys)
+        return keys
+
+    def _link(self, word, key):
+        if word not in self._word_ids:
+            word_id = self._word_ids[word] = len(self._words)
+            self._words.append(word)
+            for gram in trigrams(f' {word} '):
+                self._postings[gram].append(word_id)
+
+        keys = self._keys_by_word.get(word)
+        if keys is None:
+            self._keys_by_word[word] = key
+        elif isinstance(keys, set):
+            keys.add(key)
+        elif keys != key:
+            self._keys_by_word[word] = {keys, key}
+
+
+def split_words(text: str) -> List[str]:
+    # Emails are kept whole, everything else is split like tokenize() does
+    words = []
+    for part in str(text).lower().split():
+        if '@' in part:
+            words.append(part)
+        else:
+            words.extend(TOKEN.findall(part))
+    return words
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class QueryCache:
+    # LRU of query results. The owner bumps the generation on every change and the
+    # generation is part of every key, so results of older data are never returned,
+    # they just age out. Results are shared between the callers, nobody may change them.
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def invalidate(self):
+        self.generation += 1
+
+    def get(self, key, compute):
+        key = (self.generation, key)
+        try:
+            result = self._results[key]
+        except KeyError:
+            self.misses += 1
+            result = self._results[key] = compute()
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+            return result
+
+        self.hits += 1
+        self._results.move_to_end(key)
+        return result
@@ -1,5 +1,9 @@
 from collections import UserDict, defaultdict
 from abc import ABC, abstractmethod
+from itertools import islice
+from indexes import QueryCache, TagIndex, TextIndex
+
+NOTE_ROW = '|{:^30}|{:^50}|{:^30}|\n'
 
 class Field(ABC):
     @abstractmethod
@@ -38,7 +42,7 @@ class Item:
 
     def add_tag(self, name):
         new_tag = Tag(name)
-        if new_tag in self.tags:
+        if new_tag.value_of() in self.tags:
             return f'Tag with name {name} already exists!'
         
         self.tags.append(new_tag.value_of())
@@ -52,64 +56,166 @@ class Item:
 
 
 class Notes(UserDict):
+    storage = None
+    query_cache = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        # Indexes are built on the first query, so loading notes stays a plain assignment
+        self._text_index = None
+        self._tag_index = None
+        self._title_index = None
+        self._next_id = None
+        if self.query_cache is None:
+            self.query_cache = QueryCache()
+        self.query_cache.invalidate()
+
+    @staticmethod
+    def _normalize_title(title):
+        return str(title).strip().lower()
+
+    def _save(self, idx, note):
+        # The note is passed in because with lazy storages self.data[idx] may load a fresh copy.
+        # Every change of the notes goes through _save or _forget.
+        self.query_cache.invalidate()
+        if self._title_index is not None:
+            self._title_index.setdefault(self._normalize_title(note.title), idx)
+        if self._text_index is not None:
+            self._text_index.add(idx, note.title, note.text)
+        if self._tag_index is not None:
+            self._tag_index.add(idx, note.tags)
+        if self.storage is not None:
+            self.storage.put(idx, note)
+
+    def _forget(self, idx, title):
+        self.query_cache.invalidate()
+        if self._title_index is not None and self._title_index.get(self._normalize_title(title)) == idx:
+            del self._title_index[self._normalize_title(title)]
+        if self._text_index is not None:
+            self._text_index.remove(idx)
+        if self._tag_index is not None:
+            self._tag_index.remove(idx)
+        if self.storage is not None:
+            self.storage.delete(idx)
+
+    def _text(self):
+        if self._text_index is None:
+            self._text_index = TextIndex()
+            for idx, note in self.data.items():
+                self._text_index.add(idx, note.title, note.text)
+        return self._text_index
+
+    def _titles(self):
+        if self._title_index is None:
+            self._title_index = {}
+            for idx, note in self.data.items():
+                self._title_index.setdefault(self._normalize_title(note.title), idx)
+        return self._title_index
+
+    def _allocate_id(self):
+        # Ids are never reused, the next free id is persisted together with the notes
+        if self._next_id is None:
+            stored = self.storage.meta.get('next_id', 1) if self.storage is not None else 1
+            self._next_id = max(stored, max(self.data, default=0) + 1)
+
+        idx = self._next_id
+        self._next_id += 1
+        if self.storage is not None:
+            self.storage.set_meta('next_id', self._next_id)
+        return idx
+
+    def _tags(self):
+        if self._tag_index is None:
+            self._tag_index = TagIndex()
+            for idx, note in self.data.items():
+                self._tag_index.add(idx, note.tags)
+        return self._tag_index
 
     def add_note(self, title: Title, text: Text, tag: Tag = []):
-        new_note = Item(title, text, tag)
-        if new_note in self.data.values():
+        if self._normalize_title(title) in self._titles():
             return f"Note with title {title} already exists!"
         
-        idx = len(self.data)+1 if len(self.data) > 0 else 1
+        idx = self._allocate_id()
+        new_note = Item(title, text, tag)
         self.data[idx] = new_note
+        self._save(idx, new_note)
         return f"Note with title {title} was succesfully added!"
     
+    def iterator(self, n=1):
+        notes = iter(self.data.values())
+        page = list(islice(notes, n))
+        while page:
+            yield page
+            page = list(islice(notes, n))
+
+    def render_pages(self, page_size=20):
+        header = NOTE_ROW.format("Title", "Text", "Tags")
+        for page in self.iterator(page_size):
+            yield header + ''.join(NOTE_ROW.format(value.title, value.text, ", ".join(value.tags)) for value in page)
+            header = ''
+
     def get_notes(self):
-        notes = '|{:^30}|{:^50}|{:^30}|\n'.format("Title", "Text", "Tags")
-        for value in self.data.values():
-            tags = ", ".join(tag for tag in value.tags)
-            notes += '|{:^30}|{:^50}|{:^30}|\n'.format(value.title, value.text, tags)
-        return notes
-
-    def find_notes(self, text_to_find):
-        text_to_find = text_to_find.lower()
+        return ''.join(self.render_pages()) or NOTE_ROW.format("Title", "Text", "Tags")
+
+    def search(self, text_to_find, limit=None):
+        return self.query_cache.get(('search', text_to_find, limit), lambda: self._text().search(text_to_find, limit))
+
+    def find_notes(self, text_to_find, limit=None):
+        # The result shares the Item objects with this notebook, in order of relevance
         notes_found = Notes()
-        for note in self.data.values():
-            if note.title.lower().find(text_to_find) != -1\
-                or note.text.lower().find(text_to_find) != -1:
-                notes_found.add_note(note.title, note.text)
-        
+        notes_found.data = {idx: self.data[idx] for idx in self.search(text_to_find, limit)}
         return notes_found
     
     def find_notes_by_tag(self, tag_name: Tag=None):
-        result = []
-        for value in self.data.values():
-            if tag_name in value.tags:
-                result.append(str(value))
+        return self.query_cache.get(('tag', tag_name), lambda: "\n".join(
+            str(self.data[idx]) for idx in self._tags().keys(tag_name)
+        ))
 
-        return "\n".join(note for note in result)
+    def query_tags(self, *groups, exclude=()):
+        key = ('tags', tuple(map(tuple, groups)), tuple(exclude))
+        return self.query_cache.get(key, lambda: self._tags().query(*groups, exclude=exclude))
+
+    def find_notes_by_tags(self, expression: str):
+        # "work urgent|later -done": notes tagged work, tagged urgent or later, and not tagged done
+        groups = []
+        exclude = []
+        for word in expression.replace(',', ' ').split():
+            if word.startswith('-') and len(word) > 1:
+                exclude.append(word[1:])
+            else:
+                groups.append([tag for tag in word.split('|') if tag])
+
+        return "\n".join(str(self.data[idx]) for idx in self.query_tags(*groups, exclude=exclude))
+
+    def tag_counts(self):
+        return self._tags().counts()
 
     def delete_note(self, title_text):
-        for id, note in self.data.items():
-            if title_text.lower().strip() in note.title.lower():
-                del self.data[id]
-                return "Removed note"
-        return "No note with such title"
+        id = self.get_note_id(title_text)
+        if id is None:
+            return "No note with such title"
+
+        note = self.data.pop(id)
+        self._forget(id, note.title)
+        return "Removed note"
     
     def edit_note(self, title_text, new_text):
-        for id, note in self.data.items():
-            if title_text.lower().strip() in note.title.lower() or title_text.lower().strip() in note.title.lower():
-                self.data[id] = Item(note.title, new_text)
-                return self.get_notes()
-        return "No note with such text"
+        id = self.get_note_id(title_text)
+        if id is None:
+            return "No note with such title"
+
+        note = self.data[id]
+        note.text = new_text
+        self._save(id, note)
+        return str(note)
 
     def get_note_id(self, note_title):
-        note = Item(note_title, None)
-        note_index = None
-        for key, value in self.data.items():
-            if value == note:
-                note_index = key
-                break
-        
-        return note_index
+        return self._titles().get(self._normalize_title(note_title))
     
     def get_tags_by_note(self, notes, note_name):
         for note in notes:
@@ -118,7 +224,11 @@ class Notes(UserDict):
         return []
 
     def add_tag_for_note(self, tag_name, note_title):
-        for value in self.data.values():
-            if value.title == note_title:
-                value.add_tag(tag_name)
-            
\ No newline at end of file
+        id = self.get_note_id(note_title)
+        if id is None:
+            return "No note with such title"
+
+        note = self.data[id]
+        result = note.add_tag(tag_name)
+        self._save(id, note)
+        return result
@@ -0,0 +1,113 @@
+import math
+import time
+from collections import defaultdict, deque
+from typing import List
+
+# Runs kept per command, the percentiles follow the recent runs as the data grows
+MAX_SAMPLES = 10_000
+STATS_ROW = '{:<20} {:>5} {:>9} {:>9} {:>10} {:>12} {:>12} {:>6}'
+
+
+def percentile(values: List[float], share: float) -> float:
+    # Nearest-rank percentile of sorted values
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+class CommandProfiler:
+    # Every command is timed: the wall time is split into the time spent waiting for the
+    # answers of the user (everything read through Bot.ask) and the time computing.
+    # tracemalloc (the peak of memory allocated by the command) and cProfile are opt-in,
+    # both slow the bot down.
+    def __init__(self, trace_memory: bool = False, profile_file: str = None):
+        self.trace_memory = trace_memory
+        self.profile_file = profile_file
+        # command -> (wall, waiting for input, peak allocated bytes or None) of the recent runs
+        self.samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self.errors = defaultdict(int)
+        self.last_errors = {}
+
+        # Both are imported only when they are used, they would slow down the startup
+        self._profile = None
+        self._tracemalloc = None
+        if profile_file:
+            import cProfile
+            self._profile = cProfile.Profile()
+        self._command = None
+        self._waited = 0.0
+
+    def start(self):
+        if self.trace_memory and self._tracemalloc is None:
+            import tracemalloc
+            self._tracemalloc = tracemalloc
+            tracemalloc.start()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.dump_stats(self.profile_file)
+            self._profile = None
+            print(f'Profile of the session is saved to {self.profile_file}')
+        if self._tracemalloc is not None:
+            self._tracemalloc.stop()
+            self._tracemalloc = None
+
+    def timed_ask(self, ask):
+        def timed(text=''):
+            start = time.perf_counter()
+            try:
+                return ask(text)
+            finally:
+                self._waited += time.perf_counter() - start
+        return timed
+
+    def run(self, command: str, handler):
+        self._command = command
+        self._waited = 0.0
+        tracemalloc = self._tracemalloc
+        if tracemalloc is not None:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        if self._profile is not None:
+            self._profile.enable()
+
+        start = time.perf_counter()
+        try:
+            return handler()
+        except Exception as error:
+            self.record_error(error)
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            if self._profile is not None:
+                self._profile.disable()
+            allocated = tracemalloc.get_traced_memory()[1] - before if tracemalloc is not None else None
+            self.samples[command].append((wall, self._waited, allocated))
+            self._command = None
+
+    def record_error(self, error: BaseException):
+        command = self._command or 'no command'
+        self.errors[command] += 1
+        self.last_errors[command] = f'{type(error).__name__}: {error}'
+
+    def report(self) -> str:
+        lines = [STATS_ROW.format('command', 'runs', 'p50 ms', 'p95 ms', 'input p50', 'compute p50', 'peak KB p95', 'errors')]
+        for command in sorted(set(self.samples) | set(self.errors)):
+            samples = self.samples.get(command, ())
+            if not samples:
+                lines.append(STATS_ROW.format(command, 0, '-', '-', '-', '-', '-', self.errors[command]))
+                continue
+
+            walls = sorted(wall for wall, _, _ in samples)
+            waits = sorted(waited for _, waited, _ in samples)
+            computes = sorted(wall - waited for wall, waited, _ in samples)
+            allocated = sorted(size for _, _, size in samples if size is not None)
+            lines.append(STATS_ROW.format(
+                command, len(samples),
+                f'{percentile(walls, 0.5) * 1000:.1f}', f'{percentile(walls, 0.95) * 1000:.1f}',
+                f'{percentile(waits, 0.5) * 1000:.1f}', f'{percentile(computes, 0.5) * 1000:.1f}',
+                f'{percentile(allocated, 0.95) / 1024:.1f}' if allocated else '-',
+                self.errors.get(command, 0),
+            ))
+
+        for command, error in sorted(self.last_errors.items()):
+            lines.append(f'Last error of {command}: {error}')
+        return '\n'.join(lines)
@@ -1,10 +1,61 @@
-from bot import Bot
+import time
+
+STARTED = time.perf_counter()
+
+from storage import STORAGE_FORMATS
+from startup import ImportTimer
+import argparse
 import sys
 
 
 def run():
-    bot = Bot()
-    bot.run()
+    parser = argparse.ArgumentParser(prog='address-book')
+    parser.add_argument('--storage', choices=STORAGE_FORMATS, default='pickle',
+                        help='how contacts and notes are kept on disk (default: pickle)')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print the import times and the time to the first prompt')
+    parser.add_argument('--autosave', type=float, default=60, metavar='SECONDS',
+                        help='make the changes durable in the background every SECONDS, 0 makes every change durable '
+                             'on its own (default: 60)')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='run the commands of FILE (- for stdin) without the prompt, one command or answer per line')
+    parser.add_argument('--save-every', type=int, metavar='N',
+                        help='in batch mode, make the changes durable after every N commands (default: at the end)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record the memory allocated by every command with tracemalloc, see the stats command')
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help='profile the commands with cProfile and save the stats to FILE on exit '
+                             '(default: profile-<date>-<time>.prof)')
+    args = parser.parse_args(sys.argv[1:])
+
+    timer = ImportTimer()
+    if args.startup_report:
+        timer.start()
+
+    # Imported here so that the startup report covers the bot and everything it imports
+    from bot import Bot
+    from profiling import CommandProfiler
+
+    def report():
+        timer.stop()
+        print(timer.report(time.perf_counter() - STARTED))
+
+    profile_file = args.profile
+    if profile_file == '':
+        profile_file = time.strftime('profile-%Y%m%d-%H%M%S.prof')
+    profiler = CommandProfiler(trace_memory=args.trace_memory, profile_file=profile_file)
+
+    bot = Bot(storage_format=args.storage, autosave_interval=args.autosave, profiler=profiler)
+    if args.batch:
+        if args.batch == '-':
+            completed = bot.run_batch(sys.stdin, args.save_every)
+        else:
+            with open(args.batch, encoding='utf-8') as file:
+                completed = bot.run_batch(file, args.save_every)
+        # A script that stopped in the middle fails, so whatever runs it notices
+        sys.exit(0 if completed else 1)
+
+    bot.run(on_ready=report if args.startup_report else None)
 
 
 if __name__ == '__main__':
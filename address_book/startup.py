@@ -0,0 +1,52 @@
+import builtins
+import sys
+import time
+from typing import List, Tuple
+
+# Seconds from the start of run.py until the first prompt is shown
+STARTUP_BUDGET = 0.5
+
+
+class ImportTimer:
+    # Like python -X importtime: every module imported for the first time while the
+    # timer runs is recorded with its own time and the time including its imports
+    def __init__(self):
+        self.records: List[Tuple[int, str, float, float]] = []
+        self._original_import = None
+        self._children = [0.0]
+
+    def start(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - start
+            children = self._children.pop()
+            self._children[-1] += cumulative
+            self.records.append((len(self._children) - 1, name, cumulative - children, cumulative))
+
+    def report(self, time_to_prompt: float, top: int = 15) -> str:
+        lines = [f'{"self":>9} | {"cumulative":>10} | imported package']
+        slowest = sorted(self.records, key=lambda record: -record[3])[:top]
+        for depth, name, own, cumulative in slowest:
+            lines.append(f'{own * 1000:>7.1f}ms | {cumulative * 1000:>8.1f}ms | {"  " * depth}{name}')
+
+        total = sum(cumulative for depth, _, _, cumulative in self.records if depth == 0)
+        lines.append(f'Imports: {len(self.records)} modules in {total * 1000:.1f}ms')
+        lines.append(f'Time to first prompt: {time_to_prompt * 1000:.1f}ms (budget {STARTUP_BUDGET * 1000:.0f}ms)')
+        if time_to_prompt > STARTUP_BUDGET:
+            lines.append('Startup is over the budget!')
+        return '\n'.join(lines)
@@ -0,0 +1,845 @@
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import weakref
+import zlib
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+
+# Every journal entry is framed as <payload length><crc32 of payload><payload>,
+# so a torn write at the end of the file can be detected and dropped.
+FRAME_HEADER = struct.Struct('<II')
+PUT = 'put'
+DELETE = 'delete'
+META = 'meta'
+_DELETED = object()
+
+
+class JournalStorage:
+    def __init__(self, file_name: str, compact_after: int = 1000):
+        self.file_name = file_name
+        self.journal_file = file_name + '.journal'
+        self.rotated_journal_file = file_name + '.journal.old'
+        self.compact_after = compact_after
+        # When off, put/delete only write to the journal and flush() makes them durable
+        self.autosync = True
+
+        # Small values kept next to the data, e.g. the next free note id
+        self.meta = {}
+
+        self._journal = None
+        self._entries = 0
+        self._compaction = None
+
+    def exists(self) -> bool:
+        return any(os.path.exists(path) for path in (self.file_name, self.journal_file, self.rotated_journal_file))
+
+    def load(self) -> dict:
+        if not self.exists():
+            raise FileNotFoundError(self.file_name)
+
+        data, self.meta = self._read_snapshot()
+        self._replay(self.rotated_journal_file, data, self.meta)
+        self._entries = self._replay(self.journal_file, data, self.meta)
+        return data
+
+    def put(self, key, value):
+        self._append((PUT, key, value), sync=self.autosync)
+
+    def put_many(self, items):
+        # A batch is synced once instead of after every record. Compaction is left to
+        # the next single put/delete, so a bulk import rewrites the snapshot once and
+        # not after every batch.
+        for key, value in items:
+            self._append((PUT, key, value), sync=False, compact=False)
+        if self.autosync:
+            self._sync()
+
+    def flush(self):
+        self._sync()
+
+    def delete(self, key):
+        self._append((DELETE, key, None), sync=self.autosync)
+
+    def set_meta(self, key, value):
+        # Not synced on its own, it reaches the disk together with the next put/delete
+        self.meta[key] = value
+        self._append((META, key, value), sync=False)
+
+    def checkpoint(self, data: dict):
+        self._wait_for_compaction()
+        self._close_journal()
+        self._write_snapshot(data, self.meta)
+
+        for path in (self.journal_file, self.rotated_journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._entries = 0
+
+    def compact(self):
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+
+        # The live journal is rotated away and folded into the snapshot in the
+        # background, new changes keep going to a fresh journal meanwhile.
+        if not os.path.exists(self.rotated_journal_file):
+            self._close_journal()
+            if not os.path.exists(self.journal_file):
+                return
+            os.replace(self.journal_file, self.rotated_journal_file)
+            self._entries = 0
+
+        self._compaction = threading.Thread(target=self._fold_rotated_journal, daemon=True)
+        self._compaction.start()
+
+    def close(self):
+        self._wait_for_compaction()
+        self._sync()
+        self._close_journal()
+
+    def _append(self, entry, sync=True, compact=True):
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab')
+        self._journal.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        if sync:
+            self._sync()
+
+        self._entries += 1
+        if compact and self._entries >= self.compact_after:
+            self.compact()
+
+    def _sync(self):
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def _replay(self, path: str, data: dict, meta: dict) -> int:
+        if not os.path.exists(path):
+            return 0
+
+        entries = 0
+        with open(path, 'r+b') as file:
+            valid_end = 0
+            while True:
+                header = file.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                size, crc = FRAME_HEADER.unpack(header)
+                payload = file.read(size)
+                if len(payload) < size or zlib.crc32(payload) != crc:
+                    break
+
+                op, key, value = pickle.loads(payload)
+                if op == PUT:
+                    data[key] = value
+                elif op == META:
+                    meta[key] = value
+                else:
+                    data.pop(key, None)
+                entries += 1
+                valid_end = file.tell()
+
+            # Drop a partially written tail so that new entries are not appended after garbage
+            file.truncate(valid_end)
+
+        return entries
+
+    def _read_snapshot(self):
+        # The snapshot is the pickled data dict, optionally followed by a pickled meta dict.
+        # Older versions read only the first pickle, so they can still open it.
+        try:
+            with open(self.file_name, 'rb') as file:
+                data = pickle.load(file)
+                try:
+                    meta = pickle.load(file)
+                except EOFError:
+                    meta = {}
+                return data, meta
+        except FileNotFoundError:
+            return {}, {}
+
+    def _write_snapshot(self, data: dict, meta: dict):
+        temp_file = self.file_name + '.tmp'
+        with open(temp_file, 'wb') as file:
+            pickle.dump(data, file)
+            if meta:
+                pickle.dump(meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.file_name)
+
+    def _fold_rotated_journal(self):
+        data, meta = self._read_snapshot()
+        self._replay(self.rotated_journal_file, data, meta)
+        self._write_snapshot(data, meta)
+        os.remove(self.rotated_journal_file)
+
+    def _wait_for_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class LazyMapping(MutableMapping):
+    # Records are unpickled from the storage (a sqlite table or a record file) only when
+    # they are accessed. Changes that are not in the storage yet are kept in _pending.
+    def __init__(self, storage):
+        self._storage = storage
+        self._pending = {}
+        # A record that is still in use is returned as the same object, so the Bot can
+        # edit it in place and pass it back to add_record
+        self._decoded = weakref.WeakValueDictionary()
+        self._on_decode = None
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            value = self._pending[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+
+        value = self._decoded.get(key)
+        if value is not None:
+            return value
+
+        row = self._storage.fetch(key)
+        if row is None:
+            raise KeyError(key)
+        return self._remember(key, pickle.loads(row))
+
+    def __setitem__(self, key, value):
+        self._pending[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._pending[key] = _DELETED
+
+    def __contains__(self, key):
+        if key in self._pending:
+            return self._pending[key] is not _DELETED
+        return self._storage.fetch(key) is not None
+
+    def __iter__(self):
+        for key, _ in self._iter_rows(load_values=False):
+            yield key
+
+    def __len__(self):
+        size = self._storage.count()
+        for key, value in self._pending.items():
+            in_table = self._storage.fetch(key) is not None
+            if value is _DELETED and in_table:
+                size -= 1
+            elif value is not _DELETED and not in_table:
+                size += 1
+        return size
+
+    def items(self):
+        return _LazyItemsView(self)
+
+    def values(self):
+        return _LazyValuesView(self)
+
+    def bind(self, on_decode):
+        # on_decode is called with every value the mapping hands out for the first time
+        # (the owner of the records hooks them up), and now with those it holds already
+        self._on_decode = on_decode
+        for value in list(self._pending.values()) + list(self._decoded.values()):
+            if value is not _DELETED:
+                on_decode(value)
+
+    def lookup(self, name):
+        # (term, key) pairs of a lookup of the storage (see SqliteStorage), None when the storage
+        # keeps no such lookup. Records that are in memory are looked up as they are now, they
+        # may have been changed in place or not written yet.
+        terms = getattr(self._storage, 'lookups', {}).get(name)
+        if terms is None:
+            return None
+        in_memory = dict(self._decoded.items())
+        in_memory.update(self._pending)
+        pairs = [(term, key) for term, key in self._storage.lookup_rows(name) if key not in in_memory]
+        for key, value in in_memory.items():
+            if value is not _DELETED:
+                pairs.extend((term, key) for term in terms(value))
+        return pairs
+
+    def _remember(self, key, value):
+        if self._on_decode is not None:
+            self._on_decode(value)
+        try:
+            self._decoded[key] = value
+        except TypeError:
+            # Values without weak reference support are decoded on every access
+            pass
+        return value
+
+    def _iter_rows(self, load_values=True):
+        seen = set()
+        for key, row in self._storage.rows(load_values):
+            if key in self._pending:
+                seen.add(key)
+                value = self._pending[key]
+                if value is not _DELETED:
+                    yield key, value
+            elif not load_values:
+                yield key, None
+            else:
+                value = self._decoded.get(key)
+                yield key, value if value is not None else self._remember(key, pickle.loads(row))
+
+        for key, value in list(self._pending.items()):
+            if key not in seen and value is not _DELETED:
+                yield key, value
+
+
+class _LazyItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_rows()
+
+
+class _LazyValuesView(ValuesView):
+    def __iter__(self):
+        for _, value in self._mapping._iter_rows():
+            yield value
+
+
+class SqliteStorage:
+    def __init__(self, file_name: str, table: str = 'records', migrate_from: str = None, lookups: dict = None):
+        self.file_name = file_name
+        self.table = table
+        self.migrate_from = migrate_from
+        # name -> function(value) returning its terms. Every lookup is kept in an indexed table
+        # {table}_{name} (term, key), so keys are found by a term without unpickling the values.
+        self.lookups = lookups or {}
+        self.meta = {}
+        # When off, changes are collected in one open transaction that flush() commits
+        self.autosync = True
+
+        self._connection = None
+        self._mapping = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.file_name)
+
+    def load(self) -> LazyMapping:
+        if not self.exists():
+            if self.migrate_from is None or not JournalStorage(self.migrate_from).exists():
+                raise FileNotFoundError(self.file_name)
+            source = JournalStorage(self.migrate_from)
+            data = source.load()
+            self.meta = source.meta
+            self.migrate(data)
+
+        rows = self._connect().execute(f'SELECT key, value FROM {self.table}_meta')
+        self.meta = {key: pickle.loads(value) for key, value in rows}
+        self._mapping = LazyMapping(self)
+        return self._mapping
+
+    def migrate(self, data: dict):
+        self.flush()
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN')
+            connection.execute(f'DELETE FROM {self.table}')
+            connection.executemany(
+                f'INSERT INTO {self.table} (key, value) VALUES (?, ?)',
+                ((key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) for key, value in data.items())
+            )
+            for name in self.lookups:
+                connection.execute(f'DELETE FROM {self.table}_{name}')
+            self._write_terms(connection, data.items(), replace=False)
+            connection.execute(f'DELETE FROM {self.table}_meta')
+            connection.executemany(
+                f'INSERT INTO {self.table}_meta (key, value) VALUES (?, ?)',
+                ((key, pickle.dumps(value)) for key, value in self.meta.items())
+            )
+
+    def fetch(self, key):
+        row = self._connect().execute(f'SELECT value FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def rows(self, load_values=True):
+        column = 'value' if load_values else 'NULL'
+        return self._connect().execute(f'SELECT key, {column} FROM {self.table} ORDER BY rowid')
+
+    def count(self) -> int:
+        return self._connect().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def lookup_rows(self, name):
+        return self._connect().execute(f'SELECT term, key FROM {self.table}_{name} ORDER BY rowid')
+
+    def put(self, key, value):
+        # One transaction, the row and its lookup terms change together
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        items = list(items)
+        connection = self._write()
+        if not connection.in_transaction:
+            connection.execute('BEGIN')
+        connection.executemany(
+            f'INSERT INTO {self.table} (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            ((key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) for key, value in items)
+        )
+        self._write_terms(connection, items)
+        if self.autosync:
+            connection.commit()
+        for key, value in items:
+            self._forget_pending(key, value)
+
+    def delete(self, key):
+        connection = self._write()
+        if not connection.in_transaction:
+            connection.execute('BEGIN')
+        connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+        for name in self.lookups:
+            connection.execute(f'DELETE FROM {self.table}_{name} WHERE key = ?', (key,))
+        if self.autosync:
+            connection.commit()
+        self._forget_pending(key)
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+        self._write().execute(
+            f'INSERT INTO {self.table}_meta (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, pickle.dumps(value))
+        )
+
+    def checkpoint(self, data):
+        if data is not self._mapping:
+            self.migrate(data)
+            return
+
+        for key, value in list(self._mapping._pending.items()):
+            if value is _DELETED:
+                self.delete(key)
+            else:
+                self.put(key, value)
+        self.flush()
+
+    def flush(self):
+        if self._connection is not None and self._connection.in_transaction:
+            self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self.flush()
+            self._connection.close()
+            self._connection = None
+
+    def _forget_pending(self, key, value=None):
+        # The written value stays the one that is returned for the key while it is in use
+        if self._mapping is not None:
+            self._mapping._pending.pop(key, None)
+            if value is None:
+                self._mapping._decoded.pop(key, None)
+            else:
+                self._mapping._remember(key, value)
+
+    def _write_terms(self, connection, items, replace=True, names=None):
+        for name in names or self.lookups:
+            terms = self.lookups[name]
+            if replace:
+                connection.executemany(f'DELETE FROM {self.table}_{name} WHERE key = ?', ((key,) for key, _ in items))
+            connection.executemany(
+                f'INSERT INTO {self.table}_{name} (term, key) VALUES (?, ?)',
+                ((term, key) for key, value in items for term in terms(value))
+            )
+
+    def _write(self) -> sqlite3.Connection:
+        connection = self._connect()
+        if not self.autosync and not connection.in_transaction:
+            connection.execute('BEGIN')
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Autocommit mode: with autosync on every put/delete is its own durable transaction
+            self._connection = sqlite3.connect(self.file_name, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            # The key column has no declared type so that integer note ids stay integers
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (key PRIMARY KEY, value BLOB NOT NULL)')
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table}_meta (key PRIMARY KEY, value BLOB NOT NULL)')
+            self._create_lookups()
+        return self._connection
+
+    def _create_lookups(self):
+        connection = self._connection
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [name for name in self.lookups if f'{self.table}_{name}' not in tables]
+        if not missing:
+            return
+
+        connection.execute('BEGIN')
+        for name in missing:
+            connection.execute(f'CREATE TABLE {self.table}_{name} (term NOT NULL, key NOT NULL)')
+            connection.execute(f'CREATE INDEX {self.table}_{name}_term ON {self.table}_{name} (term)')
+            connection.execute(f'CREATE INDEX {self.table}_{name}_key ON {self.table}_{name} (key)')
+        # A database written before the lookup existed has it filled from all its values once
+        rows = connection.execute(f'SELECT key, value FROM {self.table}').fetchall()
+        self._write_terms(connection, [(key, pickle.loads(value)) for key, value in rows], replace=False, names=missing)
+        connection.commit()
+
+
+# Record file layout:
+#   <file header: magic, version>
+#   <record>*    each is <mark><key length><value length><crc32 of key and value><pickled key><pickled value>
+#   <index>      a record with the index mark, its value is the pickled
+#                (meta, [(key, offset), ...], bytes of the file not used by this index)
+#   <footer: offset of the index, end magic>
+# A checkpoint may append the changed records, a new index and a new footer to the file
+# (version 2). The last index is the one in use, the old versions of the records and the
+# old indexes stay in the file until it is rewritten.
+# One contact is read by looking up its offset and unpickling only that record. When the
+# index is damaged the records are found again by scanning for their marks, records with
+# a wrong checksum are skipped.
+RECORD_FILE_MAGIC = b'ABRF'
+RECORD_FILE_VERSION = 2
+RECORD_MARK = b'RCD\x00'
+INDEX_MARK = b'IDX\x00'
+FOOTER_MAGIC = b'ABRX'
+FILE_HEADER = struct.Struct('<4sH')
+RECORD_HEADER = struct.Struct('<4sIII')
+FILE_FOOTER = struct.Struct('<Q4s')
+
+
+class RecordFileError(OSError):
+    pass
+
+
+class RecordFile:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.meta = {}
+        self.offsets = {}
+        # Bytes taken by old versions of records and old indexes, the file is rewritten when they pile up
+        self.stale = 0
+        self.index_offset = None
+        # Number of damaged records that were skipped
+        self.skipped = 0
+        # Whether the checksum of every record in offsets was checked, see _verify
+        self._verified = False
+
+        self._file = open(file_name, 'rb')
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < FILE_HEADER.size:
+                raise RecordFileError(f'{file_name} is not a record file')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version = FILE_HEADER.unpack_from(self._map, 0)
+            if magic != RECORD_FILE_MAGIC:
+                raise RecordFileError(f'{file_name} is not a record file')
+            if version > RECORD_FILE_VERSION:
+                raise RecordFileError(f'{file_name} was written by a newer version')
+
+            if not self._read_index():
+                self._scan()
+        except Exception:
+            self.close()
+            raise
+
+    def fetch(self, key):
+        offset = self.offsets.get(key)
+        if offset is None:
+            return None
+        frame = self._read(offset, RECORD_MARK)
+        if frame is None:
+            # Damaged, from now on the record does not exist
+            del self.offsets[key]
+            self.skipped += 1
+            return None
+        return frame[1]
+
+    def raw(self, key):
+        # (pickled key, pickled value) as stored, used to copy a record without unpickling it
+        offset = self.offsets.get(key)
+        return None if offset is None else self._read(offset, RECORD_MARK)
+
+    def rows(self, load_values=True):
+        if not load_values:
+            self._verify()
+        for key in list(self.offsets):
+            if not load_values:
+                yield key, None
+                continue
+            row = self.fetch(key)
+            if row is not None:
+                yield key, row
+
+    def count(self) -> int:
+        self._verify()
+        return len(self.offsets)
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _read(self, offset, mark):
+        if offset + RECORD_HEADER.size > len(self._map):
+            return None
+        found_mark, key_size, value_size, crc = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + key_size + value_size
+        if found_mark != mark or end > len(self._map):
+            return None
+        key, value = self._map[start:start + key_size], self._map[start + key_size:end]
+        if zlib.crc32(value, zlib.crc32(key)) != crc:
+            return None
+        return key, value
+
+    def _verify(self):
+        # Listing only the keys or counting them must not report a damaged record either,
+        # so the first time either is needed every record is checked once
+        if self._verified:
+            return
+        for key, offset in list(self.offsets.items()):
+            if self._read(offset, RECORD_MARK) is None:
+                del self.offsets[key]
+                self.skipped += 1
+        self._verified = True
+
+    def _read_index(self) -> bool:
+        if len(self._map) < FILE_HEADER.size + FILE_FOOTER.size:
+            return False
+        index_offset, magic = FILE_FOOTER.unpack_from(self._map, len(self._map) - FILE_FOOTER.size)
+        if magic != FOOTER_MAGIC:
+            return False
+        frame = self._read(index_offset, INDEX_MARK)
+        if frame is None:
+            return False
+        self._use_index(index_offset, frame[1])
+        return True
+
+    def _use_index(self, offset, payload):
+        index = pickle.loads(payload)
+        self.meta, entries = index[:2]
+        self.offsets = dict(entries)
+        self.index_offset = offset
+        # Version 1 files were never appended to
+        self.stale = index[2] if len(index) > 2 else 0
+
+    def size(self) -> int:
+        return len(self._map)
+
+    def record_size(self, key) -> int:
+        offset = self.offsets.get(key)
+        if offset is None or offset + RECORD_HEADER.size > len(self._map):
+            return 0
+        _, key_size, value_size, _ = RECORD_HEADER.unpack_from(self._map, offset)
+        return RECORD_HEADER.size + key_size + value_size
+
+    def _scan(self):
+        # An index found on the way replaces the records before it, the records after the
+        # last index are from an append that did not finish (they are in the journal too)
+        offset = FILE_HEADER.size
+        index_found = False
+        while 0 <= offset < len(self._map):
+            frame = self._read(offset, RECORD_MARK)
+            if frame is not None:
+                self.offsets[pickle.loads(frame[0])] = offset
+                offset += RECORD_HEADER.size + len(frame[0]) + len(frame[1])
+                continue
+            frame = self._read(offset, INDEX_MARK)
+            if frame is not None:
+                self._use_index(offset, frame[1])
+                index_found = True
+                offset += RECORD_HEADER.size + len(frame[1])
+                continue
+            self.skipped += 1
+            offset = self._next_mark(offset + 1)
+        # Every record found by the scan had a valid checksum, the ones of an index did not
+        self._verified = not index_found
+
+    def _next_mark(self, offset):
+        found = [position for position in (self._map.find(RECORD_MARK, offset), self._map.find(INDEX_MARK, offset))
+                 if position >= 0]
+        return min(found, default=-1)
+
+
+def write_record_file(file_name: str, records, meta: dict):
+    # records yields (key, pickled key, pickled value)
+    temp_file = file_name + '.tmp'
+    entries = []
+    with open(temp_file, 'wb') as file:
+        file.write(FILE_HEADER.pack(RECORD_FILE_MAGIC, RECORD_FILE_VERSION))
+        for key, key_bytes, value_bytes in records:
+            entries.append((key, file.tell()))
+            _write_frame(file, RECORD_MARK, key_bytes, value_bytes)
+        _write_index(file, meta, entries, 0)
+    os.replace(temp_file, file_name)
+
+
+def append_record_file(file_name: str, offsets: dict, stale: int, records, meta: dict):
+    # Adds records to the end of an existing file, followed by an index of offsets (the
+    # records already in the file that are kept) and the new ones. Until the new footer is
+    # on disk, a reader finds the previous index by scanning.
+    offsets = dict(offsets)
+    with open(file_name, 'r+b') as file:
+        file.seek(0, os.SEEK_END)
+        for key, key_bytes, value_bytes in records:
+            offsets[key] = file.tell()
+            _write_frame(file, RECORD_MARK, key_bytes, value_bytes)
+        _write_index(file, meta, list(offsets.items()), stale)
+
+
+def _write_frame(file, mark, key_bytes, value_bytes):
+    crc = zlib.crc32(value_bytes, zlib.crc32(key_bytes))
+    file.write(RECORD_HEADER.pack(mark, len(key_bytes), len(value_bytes), crc))
+    file.write(key_bytes)
+    file.write(value_bytes)
+
+
+def _write_index(file, meta, entries, stale):
+    index_offset = file.tell()
+    _write_frame(file, INDEX_MARK, b'', pickle.dumps((meta, entries, stale), protocol=pickle.HIGHEST_PROTOCOL))
+    file.write(FILE_FOOTER.pack(index_offset, FOOTER_MAGIC))
+    file.flush()
+    os.fsync(file.fileno())
+
+
+class RecordFileStorage(JournalStorage):
+    # The record file takes the place of the pickle snapshot: changes go to the same
+    # journal, and a checkpoint appends them to the record file. The changes since the last
+    # checkpoint are held by the mapping, so it is compacted after a bounded number of them.
+    def __init__(self, file_name: str, compact_after: int = 10_000, migrate_from: str = None):
+        super().__init__(file_name, compact_after)
+        self.migrate_from = migrate_from
+        self._mapping = None
+
+    def load(self) -> LazyMapping:
+        if not self.exists() and self.migrate_from is not None and JournalStorage(self.migrate_from).exists():
+            source = JournalStorage(self.migrate_from)
+            data = source.load()
+            self.meta = source.meta
+            self._write_snapshot(data, self.meta)
+
+        self._close_mapping()
+        self._mapping = super().load()
+        return self._mapping
+
+    def checkpoint(self, data):
+        super().checkpoint(data)
+        if data is self._mapping:
+            # Everything is in the new file now, the mapping reads from it from here on
+            old_file, data._storage = data._storage, RecordFile(self.file_name)
+            data._pending.clear()
+            old_file.close()
+
+    def close(self):
+        super().close()
+        self._close_mapping()
+
+    def put(self, key, value):
+        # Kept before the journal entry is written, which may start a compaction
+        self._keep_pending(key, value)
+        super().put(key, value)
+
+    def put_many(self, items):
+        items = list(items)
+        for key, value in items:
+            self._keep_pending(key, value)
+        super().put_many(items)
+        # Appending a batch is cheap, so a bulk import is compacted as it goes and never
+        # holds more than compact_after records in memory
+        if self._entries >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        if self._mapping is None:
+            super().compact()
+            return
+        # The mapping holds the changes already, appending them to the record file takes
+        # much less than folding the journal into a new file in the background
+        self.checkpoint(self._mapping)
+
+    def _keep_pending(self, key, value):
+        # A record edited in place is the same object as the one decoded from the file,
+        # the mapping has to know it changed so the next checkpoint does not copy the old bytes
+        if self._mapping is not None:
+            self._mapping._pending[key] = value
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.file_name):
+            # Only a journal so far, it is replayed on top of an empty file
+            write_record_file(self.file_name, (), {})
+        file = RecordFile(self.file_name)
+        return LazyMapping(file), dict(file.meta)
+
+    def _write_snapshot(self, data, meta):
+        # The changes of the live mapping are appended, until most of the file would be old
+        # versions of changed records and old indexes, then it is written again
+        file = data._storage if data is self._mapping else None
+        if file is not None and file.index_offset is not None:
+            stale = file.stale + file.size() - file.index_offset
+            stale += sum(file.record_size(key) for key in data._pending)
+            if stale <= file.size() // 2:
+                offsets = {key: offset for key, offset in file.offsets.items() if key not in data._pending}
+                append_record_file(self.file_name, offsets, stale, self._encode_pending(data), meta)
+                return
+
+        write_record_file(self.file_name, self._encode(data), meta)
+
+    def _encode(self, data):
+        dumps = pickle.dumps
+        protocol = pickle.HIGHEST_PROTOCOL
+        if not isinstance(data, LazyMapping):
+            for key, value in data.items():
+                yield key, dumps(key, protocol), dumps(value, protocol)
+            return
+
+        # Unchanged records are copied from the current file without unpickling them
+        for key, value in data._iter_rows(load_values=False):
+            if key in data._pending:
+                yield key, dumps(key, protocol), dumps(value, protocol)
+                continue
+            raw = data._storage.raw(key)
+            if raw is not None:
+                yield key, raw[0], raw[1]
+
+    def _encode_pending(self, data):
+        for key, value in data._pending.items():
+            if value is not _DELETED:
+                yield key, pickle.dumps(key, pickle.HIGHEST_PROTOCOL), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _fold_rotated_journal(self):
+        data, meta = self._read_snapshot()
+        try:
+            self._replay(self.rotated_journal_file, data, meta)
+            self._write_snapshot(data, meta)
+        finally:
+            data._storage.close()
+        os.remove(self.rotated_journal_file)
+
+    def _close_mapping(self):
+        if self._mapping is not None:
+            self._mapping._storage.close()
+        self._mapping = None
+
+
+STORAGE_FORMATS = ('pickle', 'sqlite', 'records')
+
+
+def open_storage(file_name: str, storage_format: str = 'pickle', lookups: dict = None):
+    # lookups are only kept by sqlite, see SqliteStorage
+    if storage_format == 'pickle':
+        return JournalStorage(file_name)
+    if storage_format == 'sqlite':
+        # The first start with sqlite imports the existing pickle file once
+        return SqliteStorage(os.path.splitext(file_name)[0] + '.db', migrate_from=file_name, lookups=lookups)
+    if storage_format == 'records':
+        return RecordFileStorage(os.path.splitext(file_name)[0] + '.rec', migrate_from=file_name)
+    raise ValueError(f'Unknown storage format {storage_format}')
@@ -0,0 +1,51 @@
+import re
+from datetime import date
+from typing import List, Optional, Sequence, Tuple
+
+
+# Shared by the Field classes and the batch validators below, so both accept exactly the same values
+PHONE_PATTERN = re.compile(r'[0-9]{10}')
+EMAIL_PATTERN = re.compile(r'[a-zA-Z][a-zA-Z0-9._]+@[a-zA-Z]+\.[a-zA-Z]{2,}')
+DATE_PATTERN = re.compile(r'([0-9]{1,2})\.([0-9]{1,2})\.([0-9]{4})')
+
+
+def parse_date(value: str) -> date:
+    # Same format as datetime.strptime(value, '%d.%m.%Y') but without the generic format machinery
+    match = DATE_PATTERN.fullmatch(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f'Invalid date {value!r}')
+    day, month, year = match.groups()
+    return date(int(year), int(month), int(day))
+
+
+# The batch validators take a column of raw strings and return a validity mask
+# together with the parsed values (None where the mask is False). The parsed
+# values can be turned into fields with Field.trusted without validating again.
+
+def validate_phones(values: Sequence[str]) -> Tuple[List[bool], List[Optional[int]]]:
+    match = PHONE_PATTERN.fullmatch
+    parsed = [int(value) if match(value) else None for value in values]
+    return [value is not None for value in parsed], parsed
+
+
+def validate_emails(values: Sequence[str]) -> Tuple[List[bool], List[Optional[str]]]:
+    match = EMAIL_PATTERN.fullmatch
+    mask = [match(value) is not None for value in values]
+    return mask, [value if valid else None for value, valid in zip(values, mask)]
+
+
+def validate_birthdays(values: Sequence[str]) -> Tuple[List[bool], List[Optional[date]]]:
+    # Big books repeat the same dates a lot, every distinct string is parsed once
+    cache = {}
+    parsed = []
+    for value in values:
+        try:
+            born = cache[value]
+        except KeyError:
+            try:
+                born = parse_date(value)
+            except ValueError:
+                born = None
+            cache[value] = born
+        parsed.append(born)
+    return [born is not None for born in parsed], parsed
@@ -0,0 +1,40 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from generators import make_record
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per contact and load time of a pickled address book')
+    parser.add_argument('--count', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    data = {record.name.value: record for record in map(make_record, range(args.count))}
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'contacts:          {args.count}')
+    print(f'bytes per contact: {(after - before) / args.count:.1f}')
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'contacts.bin')
+
+        start = time.perf_counter()
+        with open(file_name, 'wb') as file:
+            pickle.dump(data, file)
+        print(f'save time:         {time.perf_counter() - start:.2f}s ({os.path.getsize(file_name) / args.count:.1f} bytes per contact on disk)')
+
+        del data
+        start = time.perf_counter()
+        with open(file_name, 'rb') as file:
+            pickle.load(file)
+        print(f'load time:         {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from classes import NOT_SET, Birthday, Phone, Record
+from folder_sorter import CATEGORIES
+from notes import Item
+
+WORDS = ['meeting', 'project', 'birthday', 'present', 'shopping', 'doctor', 'travel', 'ticket', 'report',
+         'invoice', 'garden', 'recipe', 'movie', 'book', 'training', 'holiday', 'family', 'friends', 'budget',
+         'car', 'insurance', 'school', 'homework', 'concert', 'dentist', 'plumber', 'payment', 'call', 'email']
+TAGS = [f'tag{i}' for i in range(50)]
+EXTENSIONS = [extension for extensions in CATEGORIES.values() for extension in extensions] + ['.unknown']
+
+
+def contact_name(i: int) -> str:
+    return f'Contact {i}'
+
+
+def contact_phone(i: int) -> str:
+    return f'{i % 10 ** 10:010d}'
+
+
+def make_record(i: int) -> Record:
+    birthday = Birthday(f'{i % 28 + 1:02d}.{i % 12 + 1:02d}.{1950 + i % 60}')
+    return Record(contact_name(i), Phone(contact_phone(i)), birthday, NOT_SET, NOT_SET)
+
+
+def make_contacts(count: int) -> dict:
+    return {record.name.value: record for record in map(make_record, range(count))}
+
+
+def make_notes(count: int, seed: int = 0) -> dict:
+    # Same seed, same notes: the results of different runs stay comparable
+    generator = random.Random(seed)
+    notes = {}
+    for idx in range(1, count + 1):
+        title = f'Note {idx} ' + ' '.join(generator.choices(WORDS, k=2))
+        text = ' '.join(generator.choices(WORDS, k=12))
+        note = Item(title, text, generator.choice(TAGS))
+        for tag in generator.sample(TAGS, generator.randint(0, 2)):
+            if tag not in note.tags:
+                note.tags.append(tag)
+        notes[idx] = note
+    return notes
+
+
+def make_file_tree(folder: str, count: int, files_per_folder: int = 100, seed: int = 0):
+    generator = random.Random(seed)
+    for i in range(count):
+        subfolder = os.path.join(folder, f'folder_{i // files_per_folder}')
+        if i % files_per_folder == 0:
+            os.makedirs(subfolder, exist_ok=True)
+        with open(os.path.join(subfolder, f'file_{i}{generator.choice(EXTENSIONS)}'), 'wb') as file:
+            file.write(b'x' * generator.randint(0, 256))
@@ -0,0 +1,404 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from generators import TAGS, WORDS, contact_name, contact_phone, make_contacts, make_file_tree, make_notes
+
+from bot import Bot
+from folder_sorter import sort_folder
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+QUERIES = 100
+
+_data_cache = {}
+
+
+def cached(generator, size):
+    # Generating a million contacts takes a while, every size is generated once per data kind
+    key = (generator.__name__, size)
+    if key not in _data_cache:
+        # Only the data of the current size is kept
+        for other in [other for other in _data_cache if other[1] != size]:
+            del _data_cache[other]
+        _data_cache[key] = generator(size)
+    return _data_cache[key]
+
+
+@contextlib.contextmanager
+def answers(bot, values):
+    # The bot handlers ask for their arguments through bot.ask, the benchmark answers instead of a user
+    values = iter(values)
+    bot.ask = lambda text='': next(values)
+    try:
+        yield
+    finally:
+        bot.ask = input
+
+
+def make_bot(folder, contacts=None, notes=None) -> Bot:
+    os.chdir(folder)
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = Bot()
+    if contacts is not None:
+        bot.book.data = contacts
+    if notes is not None:
+        bot.notes.data = notes
+    return bot
+
+
+class Benchmark:
+    name = None
+    # Number of operations in one run, the reported time is per operation
+    ops = 1
+
+    def setup(self, size: int, folder: str):
+        pass
+
+    def before_run(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+class ContactsSave(Benchmark):
+    name = 'contacts_save'
+
+    def setup(self, size, folder):
+        self.bot = make_bot(folder, contacts=cached(make_contacts, size))
+
+    def run(self):
+        self.bot.write_to_file(self.bot.contacts_file, self.bot.book)
+
+    def teardown(self):
+        self.bot.book.storage.close()
+
+
+class ContactsLoad(ContactsSave):
+    name = 'contacts_load'
+
+    def setup(self, size, folder):
+        super().setup(size, folder)
+        super().run()
+
+    def run(self):
+        self.bot.load_file(self.bot.contacts_file, self.bot.book, '')
+
+
+class NotesSave(Benchmark):
+    name = 'notes_save'
+
+    def setup(self, size, folder):
+        self.bot = make_bot(folder, notes=cached(make_notes, size))
+
+    def run(self):
+        self.bot.write_to_file(self.bot.notes_file, self.bot.notes)
+
+    def teardown(self):
+        self.bot.notes.storage.close()
+
+
+class NotesLoad(NotesSave):
+    name = 'notes_load'
+
+    def setup(self, size, folder):
+        super().setup(size, folder)
+        super().run()
+
+    def run(self):
+        self.bot.load_file(self.bot.notes_file, self.bot.notes, '')
+
+
+class Find(Benchmark):
+    name = 'find'
+    ops = QUERIES
+
+    def setup(self, size, folder):
+        self.book = make_bot(folder, contacts=cached(make_contacts, size)).book
+        self.names = [contact_name(i) for i in random.Random(size).sample(range(size), self.ops)]
+
+    def before_run(self):
+        # The queries repeat in every run, the cache is emptied to time the search itself
+        self.book.query_cache.invalidate()
+
+    def run(self):
+        for name in self.names:
+            self.book.find(name)
+
+
+class FindCached(Find):
+    name = 'find_cached'
+
+    def before_run(self):
+        pass
+
+
+class SearchContacts(Benchmark):
+    name = 'search_contacts'
+    ops = QUERIES
+
+    def setup(self, size, folder):
+        self.book = make_bot(folder, contacts=cached(make_contacts, size)).book
+        # Names with two swapped letters, as they are typed in a hurry
+        self.queries = [contact_name(i).replace('ta', 'at') for i in random.Random(size).sample(range(size), self.ops)]
+
+    def before_run(self):
+        self.book.query_cache.invalidate()
+
+    def run(self):
+        for query in self.queries:
+            self.book.search(query, mode='fuzzy')
+
+
+class SearchPhone(Benchmark):
+    name = 'search_phone'
+    ops = QUERIES
+
+    def setup(self, size, folder):
+        self.bot = make_bot(folder, contacts=cached(make_contacts, size))
+        self.phones = [contact_phone(i) for i in random.Random(size).sample(range(size), self.ops)]
+
+    def run(self):
+        with answers(self.bot, self.phones):
+            for _ in self.phones:
+                self.bot.search_phone()
+
+
+class Birthdays(Benchmark):
+    name = 'birthday'
+
+    def setup(self, size, folder):
+        self.bot = make_bot(folder, contacts=cached(make_contacts, size))
+
+    def before_run(self):
+        self.bot.book.query_cache.invalidate()
+
+    def run(self):
+        self.bot.birthday(30)
+
+
+class BirthdaysCold(Birthdays):
+    name = 'birthday_cold'
+
+    def before_run(self):
+        # A reassigned book drops its indexes, so the run includes building the birthday index as at startup
+        self.bot.book.data = self.bot.book.data
+
+
+class GetRecords(Benchmark):
+    name = 'get_records'
+
+    def setup(self, size, folder):
+        self.book = make_bot(folder, contacts=cached(make_contacts, size)).book
+
+    def run(self):
+        self.book.get_records()
+
+
+class FindNotes(Benchmark):
+    name = 'find_notes'
+    ops = QUERIES
+
+    def setup(self, size, folder):
+        self.notes = make_bot(folder, notes=cached(make_notes, size)).notes
+        generator = random.Random(size)
+        self.queries = [' '.join(generator.sample(WORDS, generator.randint(1, 2))) for _ in range(self.ops)]
+
+    def before_run(self):
+        self.notes.query_cache.invalidate()
+
+    def run(self):
+        for query in self.queries:
+            self.notes.find_notes(query)
+
+
+class FindNotesByTag(Benchmark):
+    name = 'find_notes_by_tag'
+    ops = len(TAGS)
+
+    def setup(self, size, folder):
+        self.notes = make_bot(folder, notes=cached(make_notes, size)).notes
+
+    def before_run(self):
+        self.notes.query_cache.invalidate()
+
+    def run(self):
+        for tag in TAGS:
+            self.notes.find_notes_by_tag(tag)
+
+
+class SortFolder(Benchmark):
+    name = 'sort_folder'
+
+    def setup(self, size, folder):
+        self.size = size
+        self.folder = folder
+        self.runs = 0
+
+    def before_run(self):
+        self.runs += 1
+        self.target = os.path.join(self.folder, f'tree_{self.runs}')
+        make_file_tree(self.target, self.size)
+
+    def run(self):
+        sort_folder(self.target)
+
+    def teardown(self):
+        for run in range(1, self.runs + 1):
+            shutil.rmtree(os.path.join(self.folder, f'tree_{run}'), ignore_errors=True)
+
+
+BENCHMARKS = [ContactsSave, ContactsLoad, NotesSave, NotesLoad, Find, FindCached, SearchContacts, SearchPhone, Birthdays,
+              BirthdaysCold, GetRecords, FindNotes, FindNotesByTag, SortFolder]
+
+
+def measure(benchmark: Benchmark, repeat: int, trace_memory: bool) -> dict:
+    result = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # The first run is not timed, it warms up the lazily built indexes and measures the peak memory
+        benchmark.before_run()
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        benchmark.run()
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['peak_bytes'] = peak
+
+        timings = []
+        for _ in range(repeat):
+            benchmark.before_run()
+            gc.collect()
+            start = time.perf_counter()
+            benchmark.run()
+            timings.append(time.perf_counter() - start)
+
+    result['seconds'] = min(timings) / benchmark.ops
+    return result
+
+
+def run_benchmarks(sizes, names=None, repeat=3, max_files=10_000, trace_memory=True) -> dict:
+    results = {}
+    cwd = os.getcwd()
+    try:
+        for size in sizes:
+            for benchmark_class in BENCHMARKS:
+                if names and benchmark_class.name not in names:
+                    continue
+                if benchmark_class is SortFolder and size > max_files:
+                    continue
+
+                benchmark = benchmark_class()
+                with tempfile.TemporaryDirectory() as folder:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        benchmark.setup(size, folder)
+                    try:
+                        result = measure(benchmark, repeat, trace_memory)
+                    finally:
+                        benchmark.teardown()
+                        os.chdir(cwd)
+
+                results.setdefault(benchmark.name, {})[str(size)] = result
+                print(format_row(benchmark.name, size, result), flush=True)
+    finally:
+        _data_cache.clear()
+    return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f}{unit}'
+    return f'{seconds / 1e-9:.0f}ns'
+
+
+def format_row(name, size, result, baseline=None) -> str:
+    row = f'{name:18} {size:>9} {format_time(result["seconds"]):>10}'
+    if 'peak_bytes' in result:
+        row += f' {result["peak_bytes"] / 2 ** 20:>10.1f}MB'
+    if baseline is not None:
+        row += f' {format_time(baseline["seconds"]):>10} {result["seconds"] / baseline["seconds"] - 1:>+8.0%}'
+    return row
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    # Returns (name, size) of every benchmark that is slower than the baseline by more than the tolerance
+    regressions = []
+    print(f'\n{"benchmark":18} {"size":>9} {"time":>10} {"peak":>12} {"baseline":>10} {"change":>8}')
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            expected = baseline.get(name, {}).get(size)
+            if expected is None:
+                # Not skipped silently, a benchmark added later needs to be added to the baseline
+                print(format_row(name, int(size), result) + f' {"no baseline":>19}')
+                continue
+            row = format_row(name, int(size), result, expected)
+            if result['seconds'] > expected['seconds'] * (1 + tolerance):
+                regressions.append((name, int(size)))
+                row += '  REGRESSION'
+            print(row)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and peak memory of the address book hot paths')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated numbers of contacts / notes / files')
+    parser.add_argument('--only', default='', help='comma separated benchmark names: ' +
+                        ', '.join(benchmark.name for benchmark in BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the best one is reported')
+    parser.add_argument('--max-files', type=int, default=10_000, help='largest file tree for sort_folder')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    names = [name.strip() for name in args.only.split(',') if name.strip()]
+
+    print(f'{"benchmark":18} {"size":>9} {"time":>10} {"peak":>12}')
+    results = run_benchmarks(sizes, names, args.repeat, args.max_files, not args.no_memory)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} benchmarks are slower than the baseline')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
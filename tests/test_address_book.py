@@ -0,0 +1,110 @@
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from classes import AddressBook, Record
+
+
+def make_book(*names):
+    book = AddressBook()
+    book.data = {}
+    for i, name in enumerate(names):
+        book.add_record(Record(name, f'{i:010d}', 'Not set', 'Not set', 'Not set'))
+    return book
+
+
+def names(records):
+    return [record.name.value for record in records]
+
+
+def test_find_by_phone_follows_the_changes_of_the_records():
+    book = make_book('Ann', 'Bob')
+    assert names(book.find_by_phone('0000000001')) == ['Bob']
+
+    ann = book.data['Ann']
+    ann.add_phone('0000000001')
+    assert names(book.find_by_phone('0000000001')) == ['Bob', 'Ann']
+    ann.change_phone('0000000000', '0999999999')
+    assert book.find_by_phone('0000000000') == []
+    assert names(book.find_by_phone('0999999999')) == ['Ann']
+    ann.remove_phone('0000000001')
+    assert names(book.find_by_phone('0000000001')) == ['Bob']
+
+    book.delete(book.data['Bob'])
+    assert book.find_by_phone('0000000001') == []
+    # A contact added after the index was built is found as well
+    book.add_record(Record('Cid', '0000000001', 'Not set', 'Not set', 'Not set'))
+    assert names(book.find_by_phone('0000000001')) == ['Cid']
+
+
+def test_search_modes_by_name():
+    book = make_book('Anna', 'Annabel', 'Bob', 'Hanna')
+    assert names(book.search('Anna', mode='exact')) == ['Anna']
+    assert names(book.search('Ann', mode='prefix')) == ['Anna', 'Annabel']
+    assert names(book.search('nna')) == ['Anna', 'Annabel', 'Hanna']
+    assert names(book.search('nna', limit=2)) == ['Anna', 'Annabel']
+    assert names(book.search('annab')) == []
+    assert book.find('Bob').name.value == 'Bob'
+    assert book.find('Zed') == "There is no contacts with name 'Zed'"
+
+
+def test_name_search_follows_added_and_deleted_contacts():
+    book = make_book('Anna', 'Bob')
+    assert names(book.search('A', mode='prefix')) == ['Anna']
+    book.add_record(Record('Abe', '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.delete(book.data['Anna'])
+    assert names(book.search('A', mode='prefix')) == ['Abe']
+    assert names(book.search('b')) == ['Abe', 'Bob']
+
+
+def test_upcoming_birthdays_follow_the_changes_of_the_records():
+    book = make_book('Ann', 'Bob')
+    today = date(2024, 12, 30)
+    assert book.upcoming_birthdays(7, today) == []
+
+    book.data['Ann'].change_birthday('02.01.1990')
+    book.data['Bob'].change_birthday('30.12.1985')
+    assert [(day, record.name.value) for day, record in book.upcoming_birthdays(7, today)] == [
+        (date(2024, 12, 30), 'Bob'), (date(2025, 1, 2), 'Ann')
+    ]
+    book.delete(book.data['Bob'])
+    assert [record.name.value for _, record in book.upcoming_birthdays(7, today)] == ['Ann']
+
+
+def test_render_pages_splits_the_contacts_and_shows_the_header_once():
+    book = make_book(*(f'n{i:02d}' for i in range(5)))
+    pages = list(book.render_pages(2))
+    assert len(pages) == 3
+    header = pages[0].splitlines()[0]
+    assert 'Name' in header and 'Phones' in header
+    assert [len(page.splitlines()) for page in pages] == [3, 2, 1]
+    assert all(header not in page for page in pages[1:])
+    assert ''.join(pages) == book.get_records()
+    assert 'n04' in pages[2] and '0000000004' in pages[2]
+
+
+def test_render_pages_of_an_empty_book_is_empty_but_get_records_keeps_the_header():
+    book = make_book()
+    assert list(book.render_pages(2)) == []
+    assert 'Name' in book.get_records()
+
+
+def test_fuzzy_search_follows_the_changes_of_the_records():
+    book = make_book('Anna Smith', 'Bob')
+    assert names(book.search('smiht', mode='fuzzy')) == ['Anna Smith']
+
+    bob = book.data['Bob']
+    bob.change_email('bob@mail.com')
+    bob.change_address('Kyiv, Khreshchatyk 1')
+    assert names(book.search('kiev', mode='fuzzy')) == []
+    assert names(book.search('kyiv', mode='fuzzy')) == ['Bob']
+    bob.change_address('Lviv')
+    assert book.search('kyiv', mode='fuzzy') == []
+    assert names(book.search('bob@mail.com', mode='fuzzy')) == ['Bob']
+
+    book.delete(book.data['Anna Smith'])
+    assert book.search('smith', mode='fuzzy') == []
+    book.add_record(Record('Anne Smyth', '0000000002', 'Not set', 'Not set', 'Not set'))
+    assert names(book.search('anna smith', mode='fuzzy')) == ['Anne Smyth']
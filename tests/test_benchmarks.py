@@ -0,0 +1,36 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from run_benchmarks import BENCHMARKS, DEFAULT_BASELINE, DEFAULT_SIZES, compare, run_benchmarks
+
+
+def test_every_benchmark_has_a_baseline():
+    with open(DEFAULT_BASELINE) as file:
+        baseline = json.load(file)['results']
+    assert sorted(baseline) == sorted(benchmark.name for benchmark in BENCHMARKS)
+    for name, sizes in baseline.items():
+        # sort_folder stops at --max-files
+        assert set(map(str, DEFAULT_SIZES if name != 'sort_folder' else DEFAULT_SIZES[:2])) <= set(sizes), name
+
+
+def test_benchmarks_run_and_slower_ones_are_reported(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    results = run_benchmarks([50], ['birthday', 'get_records', 'find_notes'], repeat=1, trace_memory=False)
+    assert sorted(results) == ['birthday', 'find_notes', 'get_records']
+    assert all(result['50']['seconds'] > 0 for result in results.values())
+    # The benchmarks work in their own folders and come back
+    assert os.getcwd() == str(tmp_path)
+    assert os.listdir(str(tmp_path)) == []
+
+    baseline = {
+        'birthday': {'50': {'seconds': results['birthday']['50']['seconds'] / 2}},
+        'get_records': {'50': {'seconds': results['get_records']['50']['seconds']}},
+    }
+    assert compare(results, baseline, tolerance=0.25) == [('birthday', 50)]
+    output = capsys.readouterr().out
+    assert 'REGRESSION' in output
+    # A benchmark missing from the baseline is shown, not skipped
+    assert 'no baseline' in output
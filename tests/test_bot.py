@@ -0,0 +1,138 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from bot import Bot
+from classes import Record
+from storage import open_storage
+from startup import STARTUP_BUDGET, ImportTimer
+
+
+def answers(*lines):
+    lines = iter(lines)
+    return lambda text='': next(lines)
+
+
+def test_print_pages_stops_when_asked(capsys):
+    bot = Bot()
+    rendered = []
+
+    def pages():
+        for number in range(3):
+            rendered.append(number)
+            yield f'page {number}\n'
+
+    bot.ask = answers('', 'q')
+    bot.print_pages(pages())
+    assert capsys.readouterr().out == 'page 0\npage 1\n'
+    # The next page is rendered before the question, so there is no question after the last one
+    assert rendered == [0, 1, 2]
+
+    # Without the prompt every page is printed and nothing is asked
+    bot.ask = answers()
+    bot.interactive = False
+    bot.print_pages(pages())
+    assert capsys.readouterr().out == 'page 0\npage 1\npage 2\n'
+
+
+def test_contacts_and_notes_are_loaded_only_when_needed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bot = Bot()
+    bot.book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    bot.close()
+
+    bot = Bot()
+    # Creating the bot reads nothing, the prompt is shown before the loading
+    assert bot._contacts_loader.ident is None
+    assert bot._notes is None
+    assert bot.book.data['Ann'].get_phones() == '0123456789'
+    assert bot._notes is None
+    assert len(bot.notes.data) == 0
+    bot.close()
+
+
+def test_import_timer_records_the_imports_while_it_runs(tmp_path, monkeypatch):
+    (tmp_path / 'startup_outer.py').write_text('import startup_inner\n')
+    (tmp_path / 'startup_inner.py').write_text('')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'startup_outer', raising=False)
+    monkeypatch.delitem(sys.modules, 'startup_inner', raising=False)
+
+    timer = ImportTimer()
+    timer.start()
+    try:
+        import startup_outer
+    finally:
+        timer.stop()
+
+    # The inner module is recorded one level deeper, and before the outer one is done
+    assert [(depth, name) for depth, name, _, _ in timer.records] == [(1, 'startup_inner'), (0, 'startup_outer')]
+    report = timer.report(STARTUP_BUDGET / 2)
+    assert 'Imports: 2 modules' in report
+    assert 'over the budget' not in report
+    assert 'Startup is over the budget!' in timer.report(STARTUP_BUDGET * 2)
+
+
+ADD_ANN = ['add', 'Ann', '0123456789', '01.03.1990', 'pass', 'pass']
+
+
+@pytest.mark.parametrize('storage_format', ['pickle', 'sqlite', 'records'])
+def test_batch_runs_the_commands_and_keeps_the_changes(tmp_path, monkeypatch, capsys, storage_format):
+    monkeypatch.chdir(tmp_path)
+    script = ['# contacts', *ADD_ANN, '', 'add', 'Bob', '0987654321', '', '', '', 'write note', 'Title', 'text', 'tag']
+    assert Bot(storage_format).run_batch(script, save_every=2)
+    assert capsys.readouterr().out.count('New contact was added!') == 2
+
+    assert Bot(storage_format).run_batch(['delete', 'Bob', 'no such command', 'show all', 'pass'])
+    output = capsys.readouterr().out
+    assert 'Unknown command: no such command' in output
+    assert 'Ann' in output and '01.03.1990' in output and 'Bob' not in output
+
+    bot = Bot(storage_format)
+    assert sorted(bot.book.data) == ['Ann']
+    assert [note.title for note in bot.notes.data.values()] == ['Title']
+    bot.close()
+
+
+def test_batch_stops_at_a_bad_answer_and_keeps_what_was_done_before(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    script = [*ADD_ANN, 'add', 'Bob', '12345', 'pass', 'pass', 'pass', *ADD_ANN]
+    assert not Bot().run_batch(script)
+    assert "Batch stopped at 'add': Invalid phone number format!" in capsys.readouterr().out
+
+    bot = Bot()
+    assert sorted(bot.book.data) == ['Ann']
+    bot.close()
+
+
+def test_batch_stops_when_the_script_ends_in_the_middle_of_a_command(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    assert not Bot().run_batch(['add', 'Ann'])
+    assert 'the script ended in the middle of a command' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('storage_format', ['pickle', 'sqlite', 'records'])
+def test_autosave_waits_for_the_running_command_and_flushes_the_changes(tmp_path, monkeypatch, storage_format):
+    monkeypatch.chdir(tmp_path)
+    bot = Bot(storage_format)
+    # As in run_async with the autosave on: the commands only write, the autosave makes the changes durable
+    bot.autosync = False
+    bot.book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    flushed = []
+    flush = bot.book.storage.flush
+    monkeypatch.setattr(bot.book.storage, 'flush', lambda: flushed.append(1) or flush())
+
+    with bot._state_lock:
+        assert not bot.autosave()
+    assert flushed == []
+    assert bot.autosave()
+    assert flushed == [1]
+
+    # Another process sees the change before the bot is closed
+    other = open_storage(bot.contacts_file, storage_format)
+    assert list(other.load()) == ['Ann']
+    other.close()
+    bot.close()
@@ -0,0 +1,93 @@
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from bot import Bot
+from classes import AddressBook, Record
+
+
+def make_book(*records):
+    book = AddressBook()
+    book.data = {}
+    for record in records:
+        book.add_record(record)
+    return book
+
+
+def sample_book():
+    ann = Record('Ann', '0123456789', '05.03.1990', 'ann@mail.com', 'Kyiv, Main st. 1')
+    ann.add_phone('0987654321')
+    return make_book(ann, Record('Bob', '0555555555', 'Not set', 'Not set', 'Not set'))
+
+
+def rows(book):
+    return sorted((record.name.value, record.get_phones(), str(record.birthday), record.email, record.address)
+                  for record in book.data.values())
+
+
+def test_csv_export_and_import_keep_the_contacts(tmp_path):
+    file_name = str(tmp_path / 'contacts.csv')
+    book = sample_book()
+    assert book.export_contacts(file_name) == 2
+
+    imported = make_book()
+    result = imported.import_contacts(file_name)
+    assert (result.imported, result.rejected, result.reject_file) == (2, 0, None)
+    assert rows(imported) == rows(book)
+
+
+def test_vcard_export_and_import_keep_the_contacts(tmp_path):
+    file_name = str(tmp_path / 'contacts.vcf')
+    book = sample_book()
+    assert book.export_contacts(file_name) == 2
+    with open(file_name, encoding='utf-8') as file:
+        # The comma of the address is escaped
+        assert 'ADR:;;Kyiv\\, Main st. 1;;;;' in file.read()
+
+    imported = make_book()
+    assert imported.import_contacts(file_name).imported == 2
+    assert rows(imported) == rows(book)
+
+
+def test_import_writes_rejected_rows_with_the_reason(tmp_path):
+    file_name = str(tmp_path / 'contacts.csv')
+    with open(file_name, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'phones', 'birthday', 'email', 'address'])
+        writer.writerow(['Ann', '0123456789', '', '', ''])
+        writer.writerow(['Bob', '12', '', '', ''])
+        writer.writerow(['Cid', '0123456789', '31.02.1990', '', ''])
+        writer.writerow(['Ann', '0987654321', '', '', ''])
+
+    book = make_book(Record('Dan', '0555555555', 'Not set', 'Not set', 'Not set'))
+    result = book.import_contacts(file_name, batch_size=2)
+    assert (result.imported, result.rejected) == (1, 3)
+    assert sorted(book.data) == ['Ann', 'Dan']
+
+    with open(result.reject_file, newline='', encoding='utf-8') as file:
+        errors = {row['name'] + row['phones']: row['error'] for row in csv.DictReader(file)}
+    assert errors == {
+        'Bob12': 'phone must contain 10 digits',
+        'Cid0123456789': 'birthday must be in DD.MM.YYYY format',
+        'Ann0987654321': 'contact already exists',
+    }
+
+
+def test_bot_reports_a_file_that_cannot_be_imported(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('binary.csv', 'wb') as file:
+        file.write(b'name,phones\n\xff\xfe,0123456789\n')
+    with open('huge.csv', 'w', encoding='utf-8') as file:
+        file.write('name,phones\n' + 'x' * (csv.field_size_limit() + 1) + ',0123456789\n')
+
+    bot = Bot()
+    try:
+        for file_name in ('binary.csv', 'huge.csv'):
+            bot.ask = lambda text='': file_name
+            report = bot.import_contacts()
+            assert report.startswith('Contacts were not imported: ')
+            assert report.endswith('(0 were imported before the error)')
+    finally:
+        bot.close()
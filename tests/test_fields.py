@@ -0,0 +1,55 @@
+import os
+import pickle
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+import classes
+from classes import Birthday, Email, Field, Phone, Record
+
+
+def make_record():
+    return Record('Ann', '0123456789', '29.02.1992', 'ann@mail.com', 'Kyiv')
+
+
+def test_pickled_record_loads_without_validating_the_fields(monkeypatch):
+    data = pickle.dumps(make_record())
+
+    def fail(self, value):
+        raise AssertionError('validated again')
+    for field_class in (Phone, Birthday, Email):
+        monkeypatch.setattr(field_class, 'is_valid', fail)
+    record = pickle.loads(data)
+
+    assert record.get_phones() == '0123456789'
+    assert record.birthday.date.isoformat() == '1992-02-29'
+    assert record.email == 'ann@mail.com'
+
+
+def test_fields_pickled_as_constructor_calls_still_load(monkeypatch):
+    # How fields were pickled before they kept their packed value
+    monkeypatch.setattr(Field, '__reduce__', lambda self: (self.__class__, (self.value,)))
+    data = pickle.dumps(make_record())
+    monkeypatch.undo()
+
+    record = pickle.loads(data)
+    assert record.get_phones() == '0123456789'
+    assert str(record.birthday) == '29.02.1992'
+
+
+def test_fields_of_a_newer_format_are_refused(monkeypatch):
+    monkeypatch.setattr(classes, 'FIELD_FORMAT', classes.FIELD_FORMAT + 1)
+    data = pickle.dumps(Phone('0123456789'))
+    monkeypatch.undo()
+
+    with pytest.raises(pickle.UnpicklingError):
+        pickle.loads(data)
+
+
+def test_fields_reject_invalid_values():
+    for field_class, value in ((Phone, '12345'), (Birthday, '31.02.1990'), (Email, 'ann@'), (Email, '')):
+        with pytest.raises(ValueError):
+            field_class(value)
+    assert Phone('0012345678').value == '0012345678'
@@ -0,0 +1,160 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from bot import Bot
+from folder_sorter import FINISHED, MOVED, SCANNED, SKIPPED, SortPlan, execute_plan, load_manifest, plan_sort, sort_folder
+
+
+def make_files(folder, files):
+    for path, content in files.items():
+        path = os.path.join(folder, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+
+
+def tree(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+                  for root, _, names in os.walk(folder) for name in names if not name.startswith('.sort_manifest'))
+
+
+def test_plan_moves_files_into_categories_without_overwriting(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'a.jpg': '1', 'docs/a.jpg': '2', 'images/a.jpg': '3', 'notes.txt': '4', 'x.unknownext': '5'})
+
+    plan = plan_sort(folder)
+    assert plan.files_scanned == 5
+    assert len(plan) == 4
+    # A plan can be stored and executed later
+    plan.dump(str(tmp_path / 'plan.json'))
+    execute_plan(SortPlan.load(str(tmp_path / 'plan.json')), workers=2)
+    os.remove(str(tmp_path / 'plan.json'))
+
+    assert tree(folder) == ['documents/notes.txt', 'images/a (1).jpg', 'images/a (2).jpg', 'images/a.jpg',
+                            'unknown/x.unknownext']
+    # The emptied folder is removed
+    assert not os.path.exists(os.path.join(folder, 'docs'))
+
+
+def test_incremental_sort_skips_unchanged_category_folders(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'a.jpg': '1', 'b.txt': '2'})
+    stats = sort_folder(folder, incremental=True)
+    assert stats.files_moved == 2
+
+    plan = plan_sort(folder, incremental=True)
+    assert plan.files_scanned == 0
+    assert not plan.manifest_changed
+
+    make_files(folder, {'c.jpg': '3'})
+    assert [os.path.basename(move.destination) for move in plan_sort(folder, incremental=True).moves] == ['c.jpg']
+
+
+def test_manifest_is_saved_after_dedupe_merge(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'images/a.jpg': 'same', 'b.jpg': 'same', 'c.jpg': 'other'})
+    sort_folder(folder, incremental=True, dedupe='merge')
+    assert tree(folder) == ['images/a.jpg', 'images/c.jpg']
+
+    # The removal of the copy is in the manifest as well, the next run does not list the folder again
+    images = os.path.join(folder, 'images')
+    assert load_manifest(folder)['images'][0] == os.stat(images).st_mtime_ns
+    assert plan_sort(folder, incremental=True).files_scanned == 0
+
+
+def test_watch_folder_is_refused_in_batch_mode(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    bot = Bot()
+    assert not bot.run_batch(['watch folder', str(tmp_path), 'show all'])
+    assert "Batch stopped at 'watch folder': watch folder needs the prompt" in capsys.readouterr().out
+
+
+def test_merged_duplicates_are_not_counted_as_moved(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'images/a.jpg': 'same', 'b.jpg': 'same', 'c.jpg': 'same', 'd.jpg': 'other', 'e.txt': 'same'})
+
+    stats = sort_folder(folder, dedupe='merge')
+    assert (stats.files_moved, stats.files_merged) == (2, 2)
+    assert stats.bytes_moved == len('other') + len('same')
+    assert dict(stats.categories) == {'images': 1, 'documents': 1}
+    assert stats.as_dict()['files_merged'] == 2
+    assert 'merged 2 duplicates' in str(stats)
+    assert tree(folder) == ['documents/e.txt', 'images/a.jpg', 'images/d.jpg']
+
+
+def test_dedupe_report_keeps_the_copies(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'images/a.jpg': 'same', 'b.jpg': 'same', 'images/old1.jpg': 'old', 'images/old2.jpg': 'old'})
+
+    stats = sort_folder(folder, dedupe='report')
+    # Copies that were in the folder before are not reported, only the groups with a new file
+    assert {category: [[os.path.basename(path) for path in group] for group in groups]
+            for category, groups in stats.duplicates.items()} == {'images': [['a.jpg', 'b.jpg']]}
+    assert (stats.files_moved, stats.files_merged) == (1, 0)
+    assert tree(folder) == ['images/a.jpg', 'images/b.jpg', 'images/old1.jpg', 'images/old2.jpg']
+
+
+def test_sort_with_workers_gives_the_serial_result(tmp_path):
+    files = {f'{folder}/f{i}.{ext}': f'{folder}{i}' for folder in ('in', 'in/deep', 'other')
+             for i in range(20) for ext in ('jpg', 'txt', 'zzz')}
+    serial, parallel = str(tmp_path / 'serial'), str(tmp_path / 'parallel')
+    make_files(serial, files)
+    make_files(parallel, files)
+
+    serial_stats = sort_folder(serial, workers=1)
+    parallel_stats = sort_folder(parallel, workers=4)
+    assert tree(parallel) == tree(serial)
+    assert len(tree(serial)) == len(files)
+    for path in tree(serial):
+        with open(os.path.join(serial, path)) as first, open(os.path.join(parallel, path)) as second:
+            assert first.read() == second.read()
+    assert parallel_stats.as_dict()['files_moved'] == serial_stats.files_moved == len(files)
+    assert parallel_stats.categories == serial_stats.categories
+
+
+def test_sort_reports_progress_in_order(tmp_path):
+    folder = str(tmp_path)
+    make_files(folder, {'a.jpg': '1', 'b.jpg': '22', 'c.txt': '333'})
+    events = []
+
+    def on_event(event, stats):
+        events.append((event, stats.files_moved, stats.files_skipped))
+        if event == SCANNED:
+            assert (stats.files_scanned, stats.files_planned) == (3, 3)
+            # A file that appears after the plan was made is never overwritten, its move is skipped
+            make_files(folder, {'images/b.jpg': 'new'})
+
+    stats = sort_folder(folder, workers=2, on_event=on_event)
+    assert events[0] == (SCANNED, 0, 0)
+    assert events[-1] == (FINISHED, 2, 1)
+    assert sorted(event for event, *_ in events[1:-1]) == [MOVED, MOVED, SKIPPED]
+    # Every file event sees the counts that include it
+    assert sorted(moved + skipped for _, moved, skipped in events[1:-1]) == [1, 2, 3]
+    assert (stats.files_moved, stats.files_skipped, stats.bytes_moved) == (2, 1, 4)
+    assert dict(stats.categories) == {'images': 1, 'documents': 1}
+    assert stats.finished is not None and stats.elapsed > 0
+    assert tree(folder) == ['b.jpg', 'documents/c.txt', 'images/a.jpg', 'images/b.jpg']
+
+
+def test_dry_run_changes_nothing_and_its_plan_is_what_the_sort_does(tmp_path, monkeypatch, capsys):
+    folder = str(tmp_path / 'files')
+    make_files(folder, {'a.jpg': '1', 'old/a.jpg': '2', 'images/b.png': '3', 'c.mp3': '4'})
+    before = tree(folder)
+
+    plan = sort_folder(folder, dry_run=True, incremental=True)
+    assert isinstance(plan, SortPlan)
+    assert tree(folder) == before
+    assert not os.path.exists(os.path.join(folder, '.sort_manifest.json'))
+    *moves, summary = str(plan).replace(os.sep, '/').splitlines()
+    assert sorted(moves) == ['a.jpg -> images/a.jpg', 'c.mp3 -> audio/c.mp3', 'old/a.jpg -> images/a (1).jpg']
+    assert summary == '3 files will be moved, 1 folders will be removed if empty'
+
+    monkeypatch.chdir(tmp_path)
+    assert Bot().run_batch(['preview sort', folder])
+    assert '3 files will be moved' in capsys.readouterr().out
+    assert tree(folder) == before
+
+    execute_plan(plan)
+    assert tree(folder) == ['audio/c.mp3', 'images/a (1).jpg', 'images/a.jpg', 'images/b.png']
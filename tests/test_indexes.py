@@ -0,0 +1,126 @@
+import math
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from indexes import BirthdayIndex, FuzzyIndex, NameIndex, word_distance
+
+
+def test_birthday_index_build_matches_single_adds():
+    birthdays = [('Ann', date(1990, 3, 5)), ('Bob', date(1985, 12, 30)), ('Cid', date(2000, 1, 2)),
+                 ('Dan', date(1970, 3, 5))]
+    built = BirthdayIndex()
+    built.build(birthdays)
+    added = BirthdayIndex()
+    for name, birthday in birthdays:
+        added.add(name, birthday)
+
+    today = date(2024, 12, 29)
+    assert built.upcoming(366, today) == added.upcoming(366, today)
+    assert built.upcoming(7, today) == [(date(2024, 12, 30), 'Bob'), (date(2025, 1, 2), 'Cid')]
+
+
+def test_birthday_index_add_after_build():
+    index = BirthdayIndex()
+    index.build([('Ann', date(1990, 3, 5))])
+    index.add('Ann', date(1990, 3, 7))
+    index.add('Bob', date(1990, 3, 6))
+
+    assert len(index) == 2
+    assert index.upcoming(5, date(2024, 3, 4)) == [(date(2024, 3, 6), 'Bob'), (date(2024, 3, 7), 'Ann')]
+    index.remove('Ann')
+    assert index.upcoming(5, date(2024, 3, 4)) == [(date(2024, 3, 6), 'Bob')]
+
+
+def test_name_index_build_matches_single_adds():
+    names = ['Bob', 'Anna', 'Annabel', 'Carl', 'Hanna']
+    built = NameIndex()
+    built.build(names)
+    added = NameIndex()
+    for name in names:
+        added.add(name)
+
+    for query in ('', 'A', 'nn', 'Anna', 'nnab', 'x'):
+        assert built.substring(query) == added.substring(query)
+        assert built.prefix(query) == added.prefix(query)
+    assert built.substring('nna', limit=2) == ['Anna', 'Annabel']
+
+
+def test_name_index_add_and_remove_after_build():
+    index = NameIndex()
+    index.build(['Anna', 'Bob'])
+    index.add('Abe')
+    index.add('Anna')
+    index.remove('Bob')
+
+    assert len(index) == 2
+    assert index.prefix('A') == ['Abe', 'Anna']
+    assert index.substring('ob') == []
+
+
+def test_upcoming_birthdays_of_feb_29_in_a_non_leap_year():
+    index = BirthdayIndex()
+    index.build([('Leap', date(1992, 2, 29)), ('Mar', date(1990, 3, 1))])
+
+    assert index.upcoming(1, date(2023, 2, 28)) == [(date(2023, 2, 28), 'Leap')]
+    assert index.upcoming(2, date(2024, 2, 28)) == [(date(2024, 2, 29), 'Leap')]
+    assert index.upcoming(1, date(2024, 3, 1)) == [(date(2024, 3, 1), 'Mar')]
+
+
+def test_upcoming_birthdays_of_a_whole_year_lists_everyone_once():
+    index = BirthdayIndex()
+    index.build([('Ann', date(1990, 1, 1)), ('Bob', date(1990, 12, 31)), ('Cid', date(1990, 6, 15))])
+
+    assert index.upcoming(1000, date(2024, 6, 15)) == [
+        (date(2024, 6, 15), 'Cid'), (date(2024, 12, 31), 'Bob'), (date(2025, 1, 1), 'Ann')
+    ]
+    assert index.upcoming(0, date(2024, 6, 15)) == []
+
+
+def test_word_distance_counts_a_swap_of_neighbours_as_one_edit():
+    assert word_distance('anna', 'anna') == 0
+    assert word_distance('anna', 'ana') == 1
+    assert word_distance('anna', 'anne') == 1
+    assert word_distance('sarah', 'sraah') == 1
+    assert word_distance('kyiv', 'kiyv') == 1
+    assert word_distance('abcd', 'badc') == 2
+    # Gives up as soon as it is surely over the limit
+    assert word_distance('alexander', 'bob', 2) == math.inf
+    assert word_distance('anna', 'anne', 1) == 1
+
+
+def test_fuzzy_index_ranks_exact_then_prefix_then_typos():
+    index = FuzzyIndex()
+    index.add('Anna', 'Anna', 'anna@mail.com', 'Kyiv')
+    index.add('Annabel', 'Annabel', 'Lviv')
+    index.add('Hanna', 'Hanna', 'Kyiv')
+    index.add('Bob', 'Bob', 'Odesa')
+
+    assert index.search('anna') == ['Anna', 'Annabel', 'Hanna']
+    assert index.search('anan kyiv') == ['Anna']
+    assert index.search('kyv anna') == ['Anna', 'Hanna']
+    assert index.search('Lviv annabel') == ['Annabel']
+    assert index.search('anna@mail.com') == ['Anna']
+    assert index.search('anna odesa') == []
+    assert index.search('anna', limit=1) == ['Anna']
+    # A short word has to match exactly or as a prefix
+    assert index.search('bo') == ['Bob']
+    assert index.search('bx') == []
+
+    index.remove('Anna')
+    index.add('Hanna', 'Hanna', 'Lviv')
+    assert index.search('anna') == ['Annabel', 'Hanna']
+    assert index.search('kyiv') == []
+    assert len(index) == 3
+
+
+def test_fuzzy_index_with_too_many_candidates_keeps_the_best_matches():
+    index = FuzzyIndex(max_candidates=10)
+    for i in range(100):
+        index.add(f'key{i:03d}', 'maria', f'street{i}')
+    index.add('exact', 'maria', 'anna')
+    assert index.search('maria anna', limit=3) == ['exact']
+    # Equally good keys come in key order
+    assert index.search('mari', limit=3) == ['exact', 'key000', 'key001']
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from notes import Notes
+from storage import open_storage
+
+
+def make_notes(*notes):
+    book = Notes()
+    book.data = {}
+    for title, text, *tags in notes:
+        book.add_note(title, text)
+        for tag in tags:
+            book.add_tag_for_note(tag, title)
+    return book
+
+
+def open_notes(file_name, storage_format):
+    notes = Notes()
+    notes.storage = open_storage(file_name, storage_format)
+    try:
+        notes.data = notes.storage.load()
+    except FileNotFoundError:
+        notes.data = {}
+    return notes
+
+
+def titles(notes):
+    return [note.title for note in notes.data.values()]
+
+
+def test_text_search_ranks_title_matches_first():
+    notes = make_notes(('Shopping', 'milk and bread for breakfast'), ('Breakfast ideas', 'eggs, milk'),
+                       ('Work', 'call the bank'))
+
+    assert titles(notes.find_notes('breakfast')) == ['Breakfast ideas', 'Shopping']
+    # Every word has to match, as a prefix of a word of the note
+    assert titles(notes.find_notes('mil brea')) == ['Breakfast ideas', 'Shopping']
+    assert titles(notes.find_notes('milk bank')) == []
+    assert titles(notes.find_notes('breakfast', limit=1)) == ['Breakfast ideas']
+
+
+def test_text_search_follows_edits_and_deletes():
+    notes = make_notes(('Shopping', 'milk'), ('Work', 'call the bank'))
+    assert titles(notes.find_notes('milk')) == ['Shopping']
+
+    notes.edit_note('Work', 'buy milk on the way')
+    notes.delete_note('Shopping')
+    assert titles(notes.find_notes('milk')) == ['Work']
+    assert titles(notes.find_notes('bank')) == []
+
+
+def test_tag_queries():
+    notes = make_notes(('A', 'a', 'work', 'urgent'), ('B', 'b', 'work', 'later'), ('C', 'c', 'work', 'done'),
+                       ('D', 'd', 'home', 'urgent'))
+
+    assert notes.find_notes_by_tag('urgent').splitlines() == [str(notes.data[1]), str(notes.data[4])]
+    assert notes.find_notes_by_tags('work urgent|later') == f'{notes.data[1]}\n{notes.data[2]}'
+    assert notes.find_notes_by_tags('work -done') == f'{notes.data[1]}\n{notes.data[2]}'
+    assert notes.find_notes_by_tags('-work') == str(notes.data[4])
+    assert notes.tag_counts() == [('work', 3), ('urgent', 2), ('done', 1), ('home', 1), ('later', 1)]
+
+    notes.add_tag_for_note('urgent', 'C')
+    notes.delete_note('A')
+    assert notes.query_tags(['urgent']) == [3, 4]
+
+
+def test_titles_are_found_ignoring_case_and_stay_unique():
+    notes = make_notes(('Shopping', 'milk'))
+    assert notes.get_note_id(' shopping ') == 1
+    assert notes.add_note('SHOPPING', 'bread') == 'Note with title SHOPPING already exists!'
+    assert notes.edit_note('shopping', 'bread').startswith('Note: Shopping Text: bread')
+    assert notes.delete_note('nothing') == 'No note with such title'
+
+
+@pytest.mark.parametrize('storage_format', ['pickle', 'sqlite', 'records'])
+def test_note_ids_are_never_reused(tmp_path, storage_format):
+    file_name = str(tmp_path / 'notes.bin')
+    notes = open_notes(file_name, storage_format)
+    notes.add_note('A', 'a')
+    notes.add_note('B', 'b')
+    notes.delete_note('B')
+    notes.storage.close()
+
+    # The next free id is stored with the notes, the id of the deleted note stays unused
+    notes = open_notes(file_name, storage_format)
+    notes.add_note('C', 'c')
+    assert sorted(notes.data) == [1, 3]
+    assert notes.get_note_id('c') == 3
+    notes.storage.close()
+
+
+def test_render_pages_splits_the_notes_and_shows_the_header_once():
+    notes = make_notes(*((f'title{i}', f'text{i}', f'tag{i}') for i in range(3)))
+    pages = list(notes.render_pages(2))
+    assert len(pages) == 2
+    assert 'Title' in pages[0] and 'Title' not in pages[1]
+    assert 'title2' in pages[1] and 'tag2' in pages[1]
+    assert ''.join(pages) == notes.get_notes()
+    assert list(make_notes().render_pages(2)) == []
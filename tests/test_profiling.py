@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from bot import Bot
+from profiling import CommandProfiler, percentile
+
+
+def test_percentile_is_the_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 1) == 100
+    assert percentile([7.0], 0.5) == percentile([7.0], 0.95) == 7
+
+
+def test_waiting_for_an_answer_is_not_counted_as_compute():
+    profiler = CommandProfiler()
+
+    def slow_answer(text=''):
+        time.sleep(0.05)
+        return 'Ann'
+    ask = profiler.timed_ask(slow_answer)
+
+    assert profiler.run('add', lambda: ask()) == 'Ann'
+    ((wall, waited, allocated),) = profiler.samples['add']
+    assert waited >= 0.05
+    assert wall - waited < 0.05
+    assert allocated is None
+
+
+def test_errors_are_recorded_and_raised_again():
+    profiler = CommandProfiler()
+
+    def fail():
+        raise RuntimeError('disk full')
+    with pytest.raises(RuntimeError):
+        profiler.run('add', fail)
+    profiler.run('add', lambda: None)
+
+    assert len(profiler.samples['add']) == 2
+    assert profiler.errors['add'] == 1
+    report = profiler.report()
+    assert report.splitlines()[1].split()[:2] == ['add', '2']
+    assert 'Last error of add: RuntimeError: disk full' in report
+
+
+def test_trace_memory_records_the_peak_of_every_command():
+    profiler = CommandProfiler(trace_memory=True)
+    profiler.start()
+    try:
+        profiler.run('big', lambda: len(bytearray(1024 * 1024)))
+    finally:
+        profiler.stop()
+    ((_, _, allocated),) = profiler.samples['big']
+    assert allocated >= 1024 * 1024
+
+
+def test_stats_command_shows_the_commands_and_their_handled_errors(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    bot = Bot()
+    assert bot.run_batch(['hello', 'hello', 'add', '', '0123456789', 'pass', 'pass', 'pass', 'stats'])
+    output = capsys.readouterr().out
+    rows = {line.split()[0]: line.split() for line in output.splitlines() if line.startswith(('hello ', 'add '))}
+    assert rows['hello'][1] == '2'
+    assert (rows['add'][1], rows['add'][-1]) == ('1', '1')
+    # Errors the handlers turn into a hint for the user are counted as well
+    assert 'Last error of add: ValueError' in output
+    assert 'Query cache of contacts:' in output
@@ -0,0 +1,78 @@
+import gc
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from classes import AddressBook, Record
+from indexes import QueryCache
+from storage import open_storage
+
+
+def make_book(file_name, storage_format):
+    book = AddressBook()
+    book.storage = open_storage(file_name, storage_format, AddressBook.lookups)
+    try:
+        book.data = book.storage.load()
+    except FileNotFoundError:
+        book.data = {}
+    return book
+
+
+def test_query_cache_computes_once_per_generation():
+    cache = QueryCache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+
+    assert cache.get('query', compute) == 1
+    assert cache.get('query', compute) == 1
+    cache.invalidate()
+    assert cache.get('query', compute) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_query_cache_drops_the_least_recently_used():
+    cache = QueryCache(maxsize=2)
+    cache.get('a', lambda: 'a')
+    cache.get('b', lambda: 'b')
+    cache.get('a', lambda: 'not cached')
+    cache.get('c', lambda: 'c')
+
+    assert len(cache) == 2
+    assert cache.get('a', lambda: 'not cached') == 'a'
+    assert cache.get('b', lambda: 'computed again') == 'computed again'
+
+
+def test_changes_invalidate_cached_searches():
+    book = AddressBook()
+    book.data = {}
+    book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    assert [record.name.value for record in book.search('n')] == ['Ann']
+
+    book.add_record(Record('Nina', '0123456789', 'Not set', 'Not set', 'Not set'))
+    assert [record.name.value for record in book.search('n')] == ['Ann', 'Nina']
+    book.delete(book.data['Ann'])
+    assert [record.name.value for record in book.search('n')] == ['Nina']
+
+
+@pytest.mark.parametrize('storage_format', ['pickle', 'sqlite', 'records'])
+def test_edit_of_a_decoded_again_record_invalidates_cached_birthdays(tmp_path, storage_format):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = make_book(file_name, storage_format)
+    book.add_record(Record('Ann', '0123456789', '05.03.1990', 'Not set', 'Not set'))
+    book.storage.checkpoint(book.data)
+    book.storage.close()
+
+    book = make_book(file_name, storage_format)
+    today = date(2024, 3, 1)
+    assert [record.name.value for _, record in book.upcoming_birthdays(7, today)] == ['Ann']
+    # On the lazy storages the next access decodes a new object, its changes still reach the cache
+    gc.collect()
+    book.data['Ann'].change_birthday('20.03.1990')
+
+    assert book.upcoming_birthdays(7, today) == []
+    assert [record.name.value for _, record in book.upcoming_birthdays(30, today)] == ['Ann']
+    book.storage.close()
@@ -0,0 +1,315 @@
+import gc
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from classes import AddressBook, Record
+import storage
+from storage import FRAME_HEADER, JournalStorage, RecordFile, open_storage
+
+
+def make_journal(file_name, count):
+    storage = JournalStorage(file_name)
+    for i in range(count):
+        storage.put(f'key{i}', {'value': i})
+    storage.close()
+
+
+def open_book(file_name, storage_format):
+    book = AddressBook()
+    book.storage = open_storage(file_name, storage_format, AddressBook.lookups)
+    try:
+        book.data = book.storage.load()
+    except FileNotFoundError:
+        book.data = {}
+    return book
+
+
+def corrupt(file_name, position):
+    with open(file_name, 'r+b') as file:
+        file.seek(position)
+        byte = file.read(1)
+        file.seek(position)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+
+def make_record_file(file_name, names):
+    book = open_book(file_name, 'records')
+    for name in names:
+        book.add_record(Record(name, '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.checkpoint(book.data)
+    book.storage.close()
+    return file_name.replace('.bin', '.rec')
+
+
+def offset_of(record_file, key):
+    file = RecordFile(record_file)
+    try:
+        return file.offsets[key]
+    finally:
+        file.close()
+
+
+def test_journal_replay_drops_torn_tail(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    make_journal(file_name, 3)
+    size = os.path.getsize(file_name + '.journal')
+    # A crash in the middle of the last write leaves half a frame behind
+    with open(file_name + '.journal', 'r+b') as file:
+        file.truncate(size - 5)
+
+    storage = JournalStorage(file_name)
+    data = storage.load()
+    assert data == {'key0': {'value': 0}, 'key1': {'value': 1}}
+
+    # The garbage is cut off, so the next change is not appended after it
+    storage.put('key2', {'value': 2})
+    storage.close()
+    assert JournalStorage(file_name).load() == {f'key{i}': {'value': i} for i in range(3)}
+
+
+def test_journal_replay_stops_at_corrupt_entry(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    make_journal(file_name, 3)
+    with open(file_name + '.journal', 'rb') as file:
+        size, _ = FRAME_HEADER.unpack(file.read(FRAME_HEADER.size))
+    # Flip a byte in the payload of the second entry
+    corrupt(file_name + '.journal', 2 * FRAME_HEADER.size + size + 3)
+
+    assert JournalStorage(file_name).load() == {'key0': {'value': 0}}
+
+
+def test_checkpoint_folds_journal_into_snapshot(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    storage = JournalStorage(file_name)
+    storage.put('a', 1)
+    storage.put('b', 2)
+    storage.delete('a')
+    storage.checkpoint({'b': 2})
+    storage.close()
+
+    assert not os.path.exists(file_name + '.journal')
+    storage = JournalStorage(file_name)
+    assert storage.load() == {'b': 2}
+
+
+def test_sqlite_keeps_records_edited_in_place(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, 'sqlite')
+    book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.close()
+
+    # The way the bot edits a contact: change the stored record and pass it back
+    book = open_book(file_name, 'sqlite')
+    record = book.data.get('Ann')
+    record.change_email('ann@mail.com')
+    book.add_record(record)
+    book.storage.close()
+
+    assert open_book(file_name, 'sqlite').data['Ann'].email == 'ann@mail.com'
+
+
+def test_sqlite_migrates_from_pickle(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, 'pickle')
+    for name in ('Ann', 'Bob'):
+        book.add_record(Record(name, '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.checkpoint(book.data)
+    # A change that is only in the journal is migrated too
+    book.delete(book.data['Bob'])
+    book.storage.close()
+
+    book = open_book(file_name, 'sqlite')
+    assert sorted(book.data) == ['Ann']
+    assert book.data['Ann'].get_phones() == '0123456789'
+
+
+def test_record_file_drops_corrupt_record(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    names = [f'n{i}' for i in range(5)]
+    record_file = make_record_file(file_name, names)
+    corrupt(record_file, offset_of(record_file, 'n2') + 30)
+
+    book = open_book(file_name, 'records')
+    # Listing and counting the keys skip the damaged record as well, not only reading it
+    assert len(book.data) == 4
+    assert sorted(book.data) == ['n0', 'n1', 'n3', 'n4']
+    assert [record.name.value for record in book.search('n')] == ['n0', 'n1', 'n3', 'n4']
+    assert 'n2' not in book.data
+    book.storage.close()
+
+
+def test_record_file_migrates_from_pickle(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, 'pickle')
+    for name in ('Ann', 'Bob', 'Cid'):
+        book.add_record(Record(name, '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.checkpoint(book.data)
+    book.delete(book.data['Bob'])
+    book.storage.close()
+
+    book = open_book(file_name, 'records')
+    assert sorted(book.data) == ['Ann', 'Cid']
+    book.storage.close()
+    assert os.path.exists(str(tmp_path / 'contacts.rec'))
+
+
+def test_record_file_keeps_records_edited_in_place(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    make_record_file(file_name, ['Ann', 'Bob'])
+
+    book = open_book(file_name, 'records')
+    record = book.data.get('Ann')
+    record.change_email('ann@mail.com')
+    book.add_record(record)
+    # The checkpoint must not copy the old bytes of the record from the file
+    book.storage.checkpoint(book.data)
+    book.storage.close()
+
+    assert open_book(file_name, 'records').data['Ann'].email == 'ann@mail.com'
+
+
+def test_record_file_import_holds_a_bounded_number_of_records(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    make_record_file(file_name, ['Ann'])
+    book = open_book(file_name, 'records')
+    book.storage.compact_after = 50
+    for batch in range(20):
+        book.add_records(Record(f'n{batch}-{i}', '0123456789', 'Not set', 'Not set', 'Not set') for i in range(30))
+        assert len(book.data._pending) < 50
+    book.storage.close()
+
+    book = open_book(file_name, 'records')
+    assert len(book.data) == 601
+    assert book.data['n19-29'].name.value == 'n19-29'
+
+
+def test_record_file_recovers_from_torn_append(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    names = [f'n{i}' for i in range(50)]
+    record_file = make_record_file(file_name, names)
+    size = os.path.getsize(record_file)
+
+    offset = offset_of(record_file, 'n1')
+    book = open_book(file_name, 'records')
+    book.delete(book.data['n0'])
+    book.add_record(Record('Cid', '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.flush()
+    with open(file_name.replace('.bin', '.rec.journal'), 'rb') as file:
+        journal = file.read()
+    book.storage.checkpoint(book.data)
+    book.storage.close()
+    # Appended to the file, not rewritten
+    assert offset_of(record_file, 'n1') == offset
+
+    # A crash in the middle of the append: the new footer is missing and the journal is still there
+    with open(record_file, 'r+b') as file:
+        file.truncate(size + 20)
+    with open(file_name.replace('.bin', '.rec.journal'), 'wb') as file:
+        file.write(journal)
+
+    book = open_book(file_name, 'records')
+    assert sorted(book.data) == sorted(names[1:] + ['Cid'])
+    book.storage.close()
+
+
+def test_record_file_is_rewritten_when_old_versions_pile_up(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    record_file = make_record_file(file_name, ['Ann', 'Bob'])
+
+    book = open_book(file_name, 'records')
+    book.storage.compact_after = 1
+    sizes = set()
+    for i in range(20):
+        record = book.data['Ann']
+        record.change_address(f'Street {i}')
+        book.add_record(record)
+        file = book.data._storage
+        assert file.stale <= file.size() // 2
+        sizes.add(file.size())
+    book.storage.close()
+
+    # Appended a few times between the rewrites, the file does not keep growing
+    assert len(sizes) < 20
+    assert os.path.getsize(record_file) <= 2 * min(sizes)
+    assert open_book(file_name, 'records').data['Ann'].address == 'Street 19'
+
+
+@pytest.mark.parametrize('storage_format', ['sqlite', 'records'])
+def test_lazy_storage_edit_of_a_decoded_again_record_updates_the_phone_index(tmp_path, storage_format):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, storage_format)
+    book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.checkpoint(book.data)
+    book.storage.close()
+
+    book = open_book(file_name, storage_format)
+    assert [record.name.value for record in book.find_by_phone('0123456789')] == ['Ann']
+    # The records the index was built from are gone, the next access decodes a new object
+    gc.collect()
+    record = book.data['Ann']
+    record.add_phone('0987654321')
+    record.change_phone('0123456789', '0555555555')
+
+    assert book.find_by_phone('0987654321') == [record]
+    assert book.find_by_phone('0555555555') == [record]
+    assert book.find_by_phone('0123456789') == []
+    book.storage.close()
+
+
+def test_sqlite_builds_phone_and_birthday_indexes_without_unpickling(tmp_path, monkeypatch):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, 'sqlite')
+    book.add_record(Record('Ann', '0123456789', '05.03.1990', 'Not set', 'Not set'))
+    book.add_record(Record('Bob', '0987654321', '20.03.1990', 'Not set', 'Not set'))
+    book.add_record(Record('Cid', '0555555555', 'Not set', 'Not set', 'Not set'))
+    book.delete(book.data['Cid'])
+    book.storage.close()
+
+    book = open_book(file_name, 'sqlite')
+    decoded = []
+    loads = storage.pickle.loads
+    monkeypatch.setattr(storage.pickle, 'loads', lambda data: decoded.append(1) or loads(data))
+    assert [record.name.value for record in book.find_by_phone('0123456789')] == ['Ann']
+    assert book.find_by_phone('0555555555') == []
+    assert [record.name.value for _, record in book.upcoming_birthdays(7, date(2024, 3, 1))] == ['Ann']
+    # Only the found contacts are unpickled
+    assert len(decoded) == 2
+    book.storage.close()
+
+
+def test_sqlite_lookups_see_changes_not_written_yet(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = open_book(file_name, 'sqlite')
+    book.add_record(Record('Ann', '0123456789', 'Not set', 'Not set', 'Not set'))
+    book.storage.close()
+
+    book = open_book(file_name, 'sqlite')
+    record = book.data['Ann']
+    # Changed in place before the indexes are built and not passed to add_record yet
+    record.change_phone('0123456789', '0987654321')
+    record.change_birthday('05.03.1990')
+
+    assert book.find_by_phone('0987654321') == [record]
+    assert book.find_by_phone('0123456789') == []
+    assert [found for _, found in book.upcoming_birthdays(7, date(2024, 3, 1))] == [record]
+    book.storage.close()
+
+
+def test_sqlite_fills_lookups_of_an_older_database(tmp_path):
+    file_name = str(tmp_path / 'contacts.bin')
+    book = AddressBook()
+    # Written before the phones and birthdays were kept in their own tables
+    book.storage = open_storage(file_name, 'sqlite')
+    book.data = {}
+    book.add_record(Record('Ann', '0123456789', '05.03.1990', 'Not set', 'Not set'))
+    book.storage.close()
+
+    book = open_book(file_name, 'sqlite')
+    assert [record.name.value for record in book.find_by_phone('0123456789')] == ['Ann']
+    assert [record.name.value for _, record in book.upcoming_birthdays(7, date(2024, 3, 1))] == ['Ann']
+    book.storage.close()
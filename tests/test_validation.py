@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'address_book'))
+
+from classes import Birthday, Email, Phone
+from validation import parse_date, validate_birthdays, validate_emails, validate_phones
+
+
+PHONES = ['0123456789', '0012345678', '012345678', '01234567890', '012345678a', ' 0123456789', '']
+EMAILS = ['ann@mail.com', 'a.b_c@mail.ua', 'ann@mail', 'ann@mail.c', '1ann@mail.com', 'a@mail.com', '']
+BIRTHDAYS = ['29.02.1992', '1.3.1990', '29.02.1990', '31.04.1990', '01.13.1990', '01.01.90', '1990-01-01', '']
+
+
+def is_valid(field_class, value):
+    try:
+        field_class(value)
+    except ValueError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('field_class, validate, values', [
+    (Phone, validate_phones, PHONES),
+    (Email, validate_emails, EMAILS),
+    (Birthday, validate_birthdays, BIRTHDAYS),
+])
+def test_batch_validators_agree_with_the_fields(field_class, validate, values):
+    mask, parsed = validate(values)
+    assert mask == [is_valid(field_class, value) for value in values]
+    assert [value is not None for value in parsed] == mask
+    # A trusted field built from the parsed value is the same as one built from the string
+    for value, valid, packed in zip(values, mask, parsed):
+        if valid:
+            assert field_class.trusted(packed).value == field_class(value).value
+
+
+def test_validated_values_are_parsed():
+    assert validate_phones(['0012345678', 'x']) == ([True, False], [12345678, None])
+    assert validate_birthdays(['1.3.1990', '1.3.1990', '31.02.1990']) == (
+        [True, True, False], [date(1990, 3, 1), date(1990, 3, 1), None])
+    assert Birthday.trusted(date(1990, 3, 1)).value == '01.03.1990'
+
+
+def test_parse_date_rejects_other_formats_and_impossible_dates():
+    assert parse_date('29.02.2000') == date(2000, 2, 29)
+    for value in ('29.02.1900', '1990.01.01', '01.01.1990 ', None, 1990):
+        with pytest.raises(ValueError):
+            parse_date(value)